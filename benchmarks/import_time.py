@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+"""Measure how long importing each bot_bin module takes, using python -X importtime.
+
+Each module is imported in a fresh interpreter several times and the fastest run is kept.
+The times include discord.py, which every module imports, so the optional dependencies that were pulled in
+are listed as well: those are what lazy imports should keep out.
+
+Usage:
+	python benchmarks/import_time.py [--runs N] [--save baseline.json] [--compare baseline.json [--tolerance 0.25]]
+
+With --compare, exit with status 1 if any module got slower than the baseline by more than the tolerance.
+"""
+
+import argparse
+import json
+import pkgutil
+import subprocess
+import sys
+
+import bot_bin
+
+OPTIONAL_DEPENDENCIES = (
+	'asyncpg', 'aiocontextvars', 'dateutil', 'humanize', 'objgraph', 'prettytable', 'psutil', 'uvloop',
+)
+
+def import_time(module):
+	"""return the cumulative import time of module in microseconds, and the top level packages it imported"""
+	proc = subprocess.run(
+		[sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+		capture_output=True, text=True, check=True,
+	)
+	cumulative = None
+	imported = set()
+	for line in proc.stderr.splitlines():
+		if not line.startswith('import time:') or 'self [us]' in line:
+			continue
+		# import time:       self [us] | cumulative | imported package
+		self_us, cumulative_us, name = line.partition(':')[2].split('|')
+		name = name.strip()
+		imported.add(name.split('.')[0])
+		if name == module:
+			cumulative = int(cumulative_us)
+	return cumulative, imported
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--runs', type=int, default=5)
+	parser.add_argument('--save')
+	parser.add_argument('--compare')
+	parser.add_argument('--tolerance', type=float, default=0.25)
+	args = parser.parse_args()
+
+	modules = [
+		f'bot_bin.{info.name}'
+		for info in pkgutil.iter_modules(bot_bin.__path__)
+	]
+
+	results = {}
+	for module in modules:
+		try:
+			runs = [import_time(module) for _ in range(args.runs)]
+		except subprocess.CalledProcessError as exc:
+			print(f'{module:20} failed to import: {exc.stderr.strip().splitlines()[-1]}')
+			continue
+		cumulative = min(run[0] for run in runs)
+		pulled_in = sorted(set(OPTIONAL_DEPENDENCIES) & runs[0][1])
+		results[module] = cumulative
+		print(f'{module:20} {cumulative / 1000:8.1f}ms  optional dependencies: {", ".join(pulled_in) or "none"}')
+
+	if args.save:
+		with open(args.save, 'w') as f:
+			json.dump(results, f, indent='\t')
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		regressed = [
+			module for module, cumulative in results.items()
+			if module in baseline and cumulative > baseline[module] * (1 + args.tolerance)
+		]
+		for module in regressed:
+			print(f'{module} regressed: {baseline[module] / 1000:.1f}ms → {results[module] / 1000:.1f}ms')
+		if regressed:
+			sys.exit(1)
+
+if __name__ == '__main__':
+	main()
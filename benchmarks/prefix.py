@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""Compare PrefixMatcher against the unanchored alternation regex that Bot.prefix_re builds.
+
+Usage: python benchmarks/prefix.py [number of prefixes]
+"""
+
+import random
+import re
+import string
+import sys
+import timeit
+
+from bot_bin.prefix import PrefixMatcher
+
+MENTIONS = ['<@123456789012345678>', '<@!123456789012345678>']
+
+def make_prefixes(n):
+	prefixes = ['!', '?', 'bot ', 'b.']
+	rand = random.Random(0)
+	while len(prefixes) < n:
+		prefixes.append(''.join(rand.choices(string.ascii_lowercase + '!$%.', k=rand.randint(1, 5))))
+	return prefixes[:n] + MENTIONS
+
+def make_corpus(size, command_ratio, prefixes):
+	rand = random.Random(1)
+	words = 'the quick brown fox jumps over a lazy dog lol ok yeah what is this 😂 http://example.com'.split()
+	corpus = []
+	for _ in range(size):
+		message = ' '.join(rand.choices(words, k=rand.randint(1, 40)))
+		if rand.random() < command_ratio:
+			message = rand.choice(prefixes) + message
+		corpus.append(message)
+	return corpus
+
+def prefix_re(prefixes):
+	alternation = '|'.join(map(re.escape, prefixes))
+	return re.compile(fr'(?:{alternation})\s*', re.IGNORECASE)
+
+def main():
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+	prefixes = make_prefixes(n)
+	regex = prefix_re(prefixes)
+	matcher = PrefixMatcher(prefixes)
+
+	for ratio in 0.01, 0.5:
+		corpus = make_corpus(10_000, ratio, prefixes)
+		for message in corpus:
+			# the regex search is unanchored, so only compare messages which it matches at the start
+			match = regex.search(message)
+			if match is not None and match.start() == 0:
+				assert matcher.match(message) is not None, message
+
+		regex_time = min(timeit.repeat(lambda: [regex.search(m) for m in corpus], number=5, repeat=5))
+		trie_time = min(timeit.repeat(lambda: [matcher.match(m) for m in corpus], number=5, repeat=5))
+		per_message = lambda t: t / (5 * len(corpus)) * 1e9
+		print(
+			f'{len(prefixes)} prefixes, {ratio:.0%} commands: '
+			f'prefix_re {per_message(regex_time):.0f}ns/msg, '
+			f'PrefixMatcher {per_message(trie_time):.0f}ns/msg '
+			f'({regex_time / trie_time:.1f}x)'
+		)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+"""Compare render_table and paginate_table against the PrettyTable subclass on a large result.
+
+Usage: python benchmarks/table.py [number of rows]
+"""
+
+import collections
+import datetime
+import random
+import sys
+import timeit
+
+from bot_bin.misc import PrettyTable, paginate_table, render_table
+
+class Record(tuple):
+	"""stands in for asyncpg.Record, which can't be created without a database: it iterates over its values"""
+	KEYS = ('id', 'guild_id', 'name', 'score', 'created_at', 'deleted')
+	def keys(self):
+		return iter(self.KEYS)
+
+def make_rows(n):
+	rand = random.Random(0)
+	words = 'the quick brown fox jumps over a lazy dog lol ok yeah what is this 😂'.split()
+	start = datetime.datetime(2020, 1, 1)
+	return [
+		collections.OrderedDict(
+			id=i,
+			guild_id=rand.getrandbits(63),
+			name=' '.join(rand.choices(words, k=rand.randint(1, 8))),
+			score=rand.random() * 1000,
+			created_at=start + datetime.timedelta(seconds=rand.randrange(10**8)),
+			deleted=None,
+		)
+		for i in range(n)
+	]
+
+def main():
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+	rows = make_rows(n)
+	records = [Record(row.values()) for row in rows]
+
+	candidates = {
+		'PrettyTable': lambda: str(PrettyTable(records)),
+		'render_table': lambda: render_table(records),
+		'render_table (dicts)': lambda: render_table(rows),
+		'render_table (max_width=100)': lambda: render_table(records, max_width=100),
+		'paginate_table (max_width=100)': lambda: paginate_table(records, max_width=100),
+	}
+	baseline = None
+	for name, func in candidates.items():
+		elapsed = min(timeit.repeat(func, number=1, repeat=3))
+		baseline = baseline or elapsed
+		print(f'{name}: {elapsed * 1000:.0f}ms for {n} rows ({baseline / elapsed:.1f}x)')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""Measure the humanized time formatters in bot_bin.misc.
+
+natural_timedelta is measured on deltas under a month, which take the divmod path, and on longer ones,
+which use relativedelta. Running the relativedelta path on short deltas as well shows what the divmod path saves.
+
+Usage: python benchmarks/time_format.py [number of values]
+"""
+
+import datetime
+import random
+import sys
+import timeit
+
+from bot_bin import misc
+
+def make_datetimes(n, max_seconds, now):
+	rand = random.Random(0)
+	return [now - datetime.timedelta(seconds=rand.randrange(max_seconds)) for _ in range(n)]
+
+def clear_caches():
+	misc._format_units.cache_clear()
+	misc._absolute_natural_units.cache_clear()
+
+def measure(func, *, cold):
+	def run():
+		if cold:
+			clear_caches()
+		func()
+	return min(timeit.repeat(run, number=1, repeat=5))
+
+def main():
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+	now = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+	short = make_datetimes(n, misc._CALENDAR_THRESHOLD, now)
+	long = make_datetimes(n, 5 * 365 * 24 * 60 * 60, now)
+	seconds = [(now - dt).total_seconds() for dt in short]
+
+	relativedelta_short = lambda: [
+		misc._join_units(misc._calendar_units(dt.replace(microsecond=0), now), 3, False, ' ago')
+		for dt in short
+	]
+	assert relativedelta_short() == misc.natural_timedeltas(short, source=now, ago=True)
+
+	candidates = {
+		'natural_timedelta, under a month, relativedelta': (relativedelta_short, False),
+		'natural_timedelta, under a month, cold cache': (
+			lambda: [misc.natural_timedelta(dt, source=now, ago=True) for dt in short], True,
+		),
+		'natural_timedelta, under a month, warm cache': (
+			lambda: [misc.natural_timedelta(dt, source=now, ago=True) for dt in short], False,
+		),
+		'natural_timedeltas, under a month, warm cache': (
+			lambda: misc.natural_timedeltas(short, source=now, ago=True), False,
+		),
+		'natural_timedeltas, up to 5 years': (lambda: misc.natural_timedeltas(long, source=now, ago=True), False),
+		'absolute_natural_timedelta, cold cache': (
+			lambda: [misc.absolute_natural_timedelta(s) for s in seconds], True,
+		),
+		'absolute_natural_timedelta, warm cache': (
+			lambda: [misc.absolute_natural_timedelta(s) for s in seconds], False,
+		),
+		'natural_rate': (lambda: [misc.natural_rate(s) for s in seconds], False),
+		'plural': (lambda: [format(misc.plural(int(s)), 'second') for s in seconds], False),
+		'natural_join': (lambda: [misc.natural_join(['a', 'b', 'c']) for _ in seconds], False),
+	}
+	for name, (func, cold) in candidates.items():
+		elapsed = measure(func, cold=cold)
+		print(f'{name}: {elapsed / n * 1e6:.2f}µs each')
+
+if __name__ == '__main__':
+	main()
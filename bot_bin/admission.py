@@ -0,0 +1,115 @@
+import asyncio
+import contextlib
+import time
+from typing import Optional
+
+from .metrics import Histogram
+
+class Saturated(Exception):
+	"""Raised by Admission.admit when a command should be shed."""
+
+class Admission:
+	"""Limits how many commands run at once, both in total and per guild.
+
+	A command which can't run immediately waits in a bounded queue for up to timeout seconds.
+	If the queue is already full, or the wait times out, the command is shed and admit() raises Saturated.
+	A limit of None means unlimited.
+	"""
+
+	def __init__(self, *, global_limit: Optional[int] = None, guild_limit: Optional[int] = None, queue_size=100, timeout=5.0):
+		self.global_limit = global_limit
+		self.guild_limit = guild_limit
+		self.queue_size = queue_size
+		self.timeout = timeout
+
+		self._global = asyncio.Semaphore(global_limit) if global_limit is not None else None
+		# guild ID: [semaphore, number of commands holding or waiting for it]
+		self._guilds = {}
+
+		self.running = 0
+		self.waiting = 0
+		self.shed = 0
+		self.wait_times = Histogram()
+
+	@contextlib.asynccontextmanager
+	async def admit(self, guild_id: Optional[int] = None):
+		guild = self._guild_semaphore(guild_id)
+		try:
+			if self._must_wait(guild):
+				await self._wait(guild)
+			else:
+				await self._acquire(guild)
+
+			self.running += 1
+			try:
+				yield
+			finally:
+				self.running -= 1
+				if self._global is not None:
+					self._global.release()
+				if guild is not None:
+					guild.release()
+		finally:
+			self._release_guild_semaphore(guild_id)
+
+	def _must_wait(self, guild):
+		return (
+			guild is not None and guild.locked()
+			or self._global is not None and self._global.locked()
+		)
+
+	async def _wait(self, guild):
+		if self.waiting >= self.queue_size:
+			self.shed += 1
+			raise Saturated
+
+		self.waiting += 1
+		start = time.perf_counter()
+		try:
+			await asyncio.wait_for(self._acquire(guild), self.timeout)
+		except asyncio.TimeoutError:
+			self.shed += 1
+			raise Saturated from None
+		finally:
+			self.waiting -= 1
+			self.wait_times.record(time.perf_counter() - start)
+
+	async def _acquire(self, guild):
+		# take the guild's slot first, so that a flood in one guild doesn't hold global slots while it waits
+		if guild is not None:
+			await guild.acquire()
+		if self._global is not None:
+			try:
+				await self._global.acquire()
+			except BaseException:
+				if guild is not None:
+					guild.release()
+				raise
+
+	def _guild_semaphore(self, guild_id):
+		if self.guild_limit is None or guild_id is None:
+			return None
+		try:
+			entry = self._guilds[guild_id]
+		except KeyError:
+			entry = self._guilds[guild_id] = [asyncio.Semaphore(self.guild_limit), 0]
+		entry[1] += 1
+		return entry[0]
+
+	def _release_guild_semaphore(self, guild_id):
+		# drop idle guilds so that memory use is bounded by the number of guilds with commands in flight
+		entry = self._guilds.get(guild_id)
+		if entry is None:
+			return
+		entry[1] -= 1
+		if not entry[1]:
+			del self._guilds[guild_id]
+
+	def stats(self):
+		return dict(
+			running=self.running,
+			waiting=self.waiting,
+			shed=self.shed,
+			wait_p50=self.wait_times.percentile(50),
+			wait_p99=self.wait_times.percentile(99),
+		)
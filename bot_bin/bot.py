@@ -1,37 +1,129 @@
+import ast
 import asyncio
+import collections
 import contextlib
+import contextvars
+import functools
+import importlib
+import importlib.util
 import logging
 import re
+import signal
+import time
 import traceback
 
-try:
-	import asyncpg
-except ImportError:
-	HAVE_ASYNCPG = False
-else:
-	HAVE_ASYNCPG = True
-	import json
-
 import discord
+from discord import app_commands
 from discord.ext import commands
 
-try:
-	import uvloop
-except ImportError:
-	pass  # Windows
-else:
-	uvloop.install()
+from .admission import Admission, Saturated
+from .errors import ErrorGroups
+from .metrics import Timings, span
+from .prefix import GuildPrefixes, PrefixMatcher
+
+# asyncpg and uvloop are only imported once they're needed, to keep importing this module fast
+HAVE_ASYNCPG = importlib.util.find_spec('asyncpg') is not None
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('bot')
 
+# the Context of the command being invoked by the current task, if any
+current_context = contextvars.ContextVar('current_context', default=None)
+
+# Named sets of options which decide how much discord.py caches, and therefore how much memory the bot uses.
+# These are functions because Intents and MemberCacheFlags are mutable.
+CACHE_PROFILES = {
+	# for bots with only application commands: guilds and channels are cached, but no members or messages
+	'minimal': lambda: dict(
+		intents=discord.Intents(guilds=True),
+		member_cache_flags=discord.MemberCacheFlags.none(),
+		max_messages=None,
+		chunk_guilds_at_startup=False,
+	),
+	# for bots with prefixed commands, which need message content but not members or a message cache
+	'commands-only': lambda: dict(
+		intents=discord.Intents(guilds=True, guild_messages=True, dm_messages=True, message_content=True),
+		member_cache_flags=discord.MemberCacheFlags.none(),
+		max_messages=None,
+		chunk_guilds_at_startup=False,
+	),
+	# everything discord.py can cache
+	'full': lambda: dict(
+		intents=discord.Intents.all(),
+		member_cache_flags=discord.MemberCacheFlags.all(),
+		max_messages=1000,
+		chunk_guilds_at_startup=True,
+	),
+}
+
+class CommandTree(app_commands.CommandTree):
+	"""A CommandTree which records how long application commands take in bot.command_timings"""
+
+	async def interaction_check(self, interaction):
+		interaction.extras['bot_bin_started'] = time.perf_counter()
+		return True
+
+	async def on_error(self, interaction, error):
+		start = time.perf_counter()
+		try:
+			await super().on_error(interaction, error)
+		finally:
+			if interaction.command is not None:
+				self.client.command_timings.record(
+					interaction.command.qualified_name, 'error', time.perf_counter() - start,
+				)
+
 class Bot(commands.AutoShardedBot):
+	# Load startup_extensions concurrently. Only enable this if they don't depend on each other's load order.
+	concurrent_extension_loading = False
+	# Maps extension names to the names of the top level commands they define.
+	# Those commands are registered as stubs, and the extension is loaded the first time one of them is invoked.
+	lazy_extensions = {}
+
 	def __init__(self, *args, **kwargs):
 		self.config = kwargs.pop('config')
 		self._should_setup_db = kwargs.pop('setup_db', False)
+		# set by bot_bin.cluster when this bot runs one slice of the shards
+		self.cluster_id = kwargs.pop('cluster_id', None)
+		self._identify_scheduler = kwargs.pop('identify_scheduler', None)
 		if self._should_setup_db and not HAVE_ASYNCPG:
 			raise ImportError('this bot requires asyncpg but it is not installed')
 		self.process_config()
+		if self.config['guild_prefixes'] is not None and not self._should_setup_db:
+			raise ValueError("config['guild_prefixes'] requires setup_db=True")
+		# set up by init_db if config['guild_prefixes'] is set
+		self.guild_prefixes = None
+		# bot_bin.sql.BatchWriters to flush before the pool is closed
+		self.batch_writers = []
+		# bot_bin.sql.Queries to prepare on every connection. init_db loads them from config['queries'] if set.
+		self.queries = None
+		# a bot_bin.sql.ReplicaSet, set up by init_db if config['read_replicas'] is set
+		self.replicas = None
+		# how far messages got in process_commands: seen, rejected, parsed, invoked
+		self.message_stats = collections.Counter()
+		concurrency_conf = self.config['command_concurrency']
+		self.admission = None
+		if concurrency_conf is not None:
+			self.admission = Admission(**{k: v for k, v in concurrency_conf.items() if k != 'shed_policy'})
+		# latency histograms keyed by qualified command name, then by phase: context (get_context),
+		# prepare (checks and argument conversion), callback, error (on_command_error), and total (all but context)
+		self.command_timings = Timings()
+		self._user_before_invoke = None
+		self.error_groups = ErrorGroups()
+		self._error_report_task = None
+		# subclasses which customized prefixes by overriding prefix_re keep getting their regex
+		self._custom_prefix_re = type(self).prefix_re is not Bot.prefix_re
+		# the pre-filter duplicates get_prefix_, so it can't be used if a subclass changed how prefixes are found
+		self._can_prefilter = (
+			type(self).get_prefix_ is Bot.get_prefix_
+			and type(self).get_prefix is commands.AutoShardedBot.get_prefix
+			and not self._custom_prefix_re
+		)
+
+		# explicitly passed options take precedence over the profile's
+		cache_profile = kwargs.pop('cache_profile', self.config.get('cache_profile'))
+		if cache_profile is not None:
+			for option, value in CACHE_PROFILES[cache_profile]().items():
+				kwargs.setdefault(option, value)
 
 		super().__init__(
 			command_prefix=self.get_prefix_,
@@ -39,7 +131,10 @@ class Bot(commands.AutoShardedBot):
 			help_command=kwargs.pop('help_command', commands.MinimalHelpCommand()),
 			status=discord.Status.idle,  # indicate starting up
 			intents=kwargs.pop('intents', discord.Intents.default()),
+			tree_cls=kwargs.pop('tree_cls', CommandTree),
 			*args, **kwargs)
+		# installed directly rather than through before_invoke so that users can still set their own hook
+		self._before_invoke = self._timing_before_invoke_hook
 		# do this after super().__init__ in case initial_activity depends on self.is_ready()
 		self.activity = self.initial_activity()
 
@@ -57,6 +152,20 @@ class Bot(commands.AutoShardedBot):
 		overrides_conf['guilds'] = set(overrides_conf['guilds'])
 		overrides_conf['channels'] = set(overrides_conf['channels'])
 
+		concurrency_conf = self.config.setdefault('command_concurrency', None)
+		if concurrency_conf is not None:
+			concurrency_conf.setdefault('shed_policy', 'drop')
+			if concurrency_conf['shed_policy'] not in ('drop', 'reply'):
+				raise ValueError("config['command_concurrency']['shed_policy'] must be 'drop' or 'reply'")
+
+		guild_prefixes_conf = self.config.setdefault('guild_prefixes', None)
+		if guild_prefixes_conf is True:
+			self.config['guild_prefixes'] = {}
+
+		query_stats_conf = self.config.setdefault('query_stats', None)
+		if query_stats_conf is True:
+			self.config['query_stats'] = {}
+
 	def initial_activity(self):
 		try:
 			prefixes = self.config['prefixes']
@@ -66,23 +175,79 @@ class Bot(commands.AutoShardedBot):
 		return discord.Game(name=prefixes[0] + 'help') if prefixes else None
 
 	def get_prefix_(self, bot, message):
-		re = self.prefix_re
-		if re is None:
-			return commands.when_mentioned(bot, message)
+		if self._custom_prefix_re:
+			return self._match_prefix_re(bot, message)
+
+		if self.guild_prefixes is not None and message.guild is not None:
+			matcher = self.guild_prefixes.get(message.guild.id)
+			if matcher is None:
+				# discord.py awaits the prefix if it's a coroutine, so only cold guilds pay for a query
+				return self._fetch_guild_prefix(message)
+		else:
+			matcher = self.prefix_matcher
+			if matcher is None:
+				return commands.when_mentioned(bot, message)
+
+		return self._match_prefix(matcher, message)
+
+	async def _fetch_guild_prefix(self, message):
+		return self._match_prefix(await self.guild_prefixes.fetch(message.guild.id), message)
 
-		match = re.search(message.content)
+	def _match_prefix(self, matcher, message):
+		prefix = matcher.match(message.content)
 
-		if match is None:
+		if prefix is None:
 			# Callable prefixes must always return at least one prefix,
 			# but no prefix was found in the message,
 			# so we still have to return *something*.
 			# Messages are guaranteed not to start with a space.
 			return ' '
 		else:
-			return match[0]
+			return prefix
+
+	def _match_prefix_re(self, bot, message):
+		regex = self.prefix_re
+		if regex is None:
+			return commands.when_mentioned(bot, message)
+
+		match = regex.match(message.content)
+		return ' ' if match is None else match[0]
+
+	def prefixes(self, guild_prefixes=None):
+		"""return the global prefixes, or the given guild prefixes, plus the mention prefixes.
+		Return None if there are none yet.
+		"""
+		if guild_prefixes is None:
+			guild_prefixes = self.config.get('prefixes', [])
+		prefixes = list(guild_prefixes)  # ensure it's not a tuple
+		try:
+			prefixes.extend([f'<@{self.user.id}>', f'<@!{self.user.id}>'])
+		except AttributeError:
+			if not prefixes:
+				return None
+		return prefixes
+
+	@property
+	def prefix_matcher(self):
+		with contextlib.suppress(AttributeError):
+			return self._prefix_matcher
+
+		prefixes = self.prefixes()
+		if prefixes is None:
+			return None
+
+		matcher = PrefixMatcher(prefixes)
+		# only cache once the mention prefixes are known
+		if self.user is not None:
+			self._prefix_matcher = matcher
+		return matcher
 
 	@property
 	def prefix_re(self):
+		"""A regex matching the global prefixes and any whitespace after them. Prefixes are matched by
+		prefix_matcher instead, unless a subclass overrides this, in which case the regex is used
+		(anchored to the start of the message) and guild prefixes are ignored.
+		"""
 		with contextlib.suppress(AttributeError):
 			return self._prefix_re
 
@@ -118,13 +283,104 @@ class Bot(commands.AutoShardedBot):
 		await self.change_presence(activity=self.initial_activity(), status=discord.Status.online)
 
 	async def process_commands(self, message):
-		if self.should_reply(message):
-			ctx = await self.get_context(message)
+		stats = self.message_stats
+		stats['seen'] += 1
+		if not self.should_reply(message) or not self.could_be_command(message):
+			stats['rejected'] += 1
+			return
+
+		start = time.perf_counter()
+		ctx = await self.get_context(message)
+		stats['parsed'] += 1
+		if ctx.command is None:
+			await self.invoke(ctx)  # for CommandNotFound
+			return
+
+		self.command_timings.record(ctx.command.qualified_name, 'context', time.perf_counter() - start)
+		if self.admission is None:
+			stats['invoked'] += 1
 			await self.invoke(ctx)
+			return
+
+		try:
+			async with self.admission.admit(message.guild and message.guild.id):
+				stats['invoked'] += 1
+				await self.invoke(ctx)
+		except Saturated:
+			await self.on_command_shed(ctx)
+
+	async def on_command_shed(self, ctx):
+		"""Called when a command is dropped because too many commands are already running."""
+		if self.config['command_concurrency']['shed_policy'] == 'reply':
+			with contextlib.suppress(discord.HTTPException):
+				await ctx.send("I'm too busy to run that right now. Please try again in a moment.")
+
+	async def invoke(self, ctx):
+		if ctx.command is None:
+			await super().invoke(ctx)
+			return
+
+		start = time.perf_counter()
+		token = current_context.set(ctx)
+		try:
+			# the root of the command's span tree. Commands can show it with current_span().root.format_tree().
+			with span(ctx.command.qualified_name):
+				await super().invoke(ctx)
+		finally:
+			current_context.reset(token)
+			end = time.perf_counter()
+			# for groups, ctx.command is now the subcommand that ran
+			name = ctx.command.qualified_name
+			prepared = getattr(ctx, '_bot_bin_prepared', None)
+			self.command_timings.record(name, 'total', end - start)
+			if prepared is None:
+				# a check or converter failed, so the callback never ran
+				self.command_timings.record(name, 'prepare', end - start)
+			else:
+				self.command_timings.record(name, 'prepare', prepared - start)
+				self.command_timings.record(name, 'callback', end - prepared)
+
+	def before_invoke(self, coro):
+		if not asyncio.iscoroutinefunction(coro):
+			raise TypeError('The pre-invoke hook must be a coroutine.')
+		self._user_before_invoke = coro
+		return coro
+
+	async def _timing_before_invoke_hook(self, ctx):
+		# the global hook runs last, once checks and argument conversion are done
+		ctx._bot_bin_prepared = now = time.perf_counter()
+		if ctx.interaction is not None:
+			ctx.interaction.extras['bot_bin_prepared'] = now
+		if self._user_before_invoke is not None:
+			await self._user_before_invoke(ctx)
+
+	async def on_app_command_completion(self, interaction, command):
+		end = time.perf_counter()
+		started = interaction.extras.get('bot_bin_started')
+		if started is None:
+			return
+		prepared = interaction.extras.get('bot_bin_prepared')
+		name = command.qualified_name
+		self.command_timings.record(name, 'total', end - started)
+		if prepared is None:
+			self.command_timings.record(name, 'callback', end - started)
+		else:
+			# a hybrid command, which went through checks and conversion like a prefixed one
+			self.command_timings.record(name, 'prepare', prepared - started)
+			self.command_timings.record(name, 'callback', end - prepared)
+
+	@contextlib.contextmanager
+	def _timed(self, ctx, phase):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			if ctx.command is not None:
+				self.command_timings.record(ctx.command.qualified_name, phase, time.perf_counter() - start)
 
 	# based on https://github.com/Rapptz/RoboDanny/blob/ca75fae7de132e55270e53d89bc19dd2958c2ae0/bot.py#L77-L85
 	async def on_command_error(self, ctx, error):
-		with contextlib.suppress(discord.HTTPException):
+		with self._timed(ctx, 'error'), contextlib.suppress(discord.HTTPException):
 			if isinstance(error, commands.NoPrivateMessage):
 				await ctx.author.send('This command cannot be used in private messages.')
 			elif isinstance(error, commands.DisabledCommand):
@@ -143,22 +399,52 @@ class Bot(commands.AutoShardedBot):
 				and (not ctx.cog or type(ctx.cog).cog_command_error is commands.Cog.cog_command_error)  # not overridden
 				and not hasattr(ctx.command, 'on_error')
 			):
-				if ctx.interaction:
-					formatted = ' '.join(
-						f'{param}: “{argument}”'
-						for param, argument
-						in ctx.interaction.namespace
-					)
-					if ctx.interaction.command:
-						logger.exception('"/%s %s" caused an exception', ctx.interaction.command.name, formatted, exc_info=error)
-					else:
-						logger.exception('Non-command interaction "%s" caused an exception', formatted, exc_info=error)
-				else:
-					logger.exception('"%s" caused an exception <%s>', ctx.message.content, ctx.message.jump_url, exc_info=error)
+				self.log_command_exception(ctx, error)
 
 				await ctx.send('An internal error occured while trying to run that command.', ephemeral=True)
 
-	### Utility functions
+	@staticmethod
+	def _log_error_repeats(group, repeats):
+		logger.error(
+			'%s at %s in command %s occurred %d more times (%d in total)',
+			group.type, group.location, group.command, repeats, group.count,
+		)
+
+	async def _report_errors_periodically(self):
+		# log_command_exception only reports repeats when another one arrives,
+		# so this reports the last repeats of a burst of errors
+		while True:
+			await asyncio.sleep(self.error_groups.summary_interval)
+			for group, repeats in self.error_groups.pop_all_unreported():
+				self._log_error_repeats(group, repeats)
+
+	def log_command_exception(self, ctx, error):
+		"""Log the first exception of each kind in full, and only count the repeats, logging the count periodically."""
+		original = error
+		while hasattr(original, 'original'):
+			original = original.original
+
+		group, new = self.error_groups.record(original, ctx.command and ctx.command.qualified_name)
+		if not new:
+			repeats = self.error_groups.pop_unreported(group)
+			if repeats:
+				self._log_error_repeats(group, repeats)
+			return
+
+		if ctx.interaction:
+			formatted = ' '.join(
+				f'{param}: “{argument}”'
+				for param, argument
+				in ctx.interaction.namespace
+			)
+			if ctx.interaction.command:
+				logger.exception('"/%s %s" caused an exception', ctx.interaction.command.name, formatted, exc_info=error)
+			else:
+				logger.exception('Non-command interaction "%s" caused an exception', formatted, exc_info=error)
+		else:
+			logger.exception('"%s" caused an exception <%s>', ctx.message.content, ctx.message.jump_url, exc_info=error)
+
+	### Utility functions
 
 	def should_reply(self, message):
 		"""return whether the bot should reply to a given message"""
@@ -168,6 +454,28 @@ class Bot(commands.AutoShardedBot):
 			return False
 		return True
 
+	def could_be_command(self, message):
+		"""return False if a message is definitely not a command, using only its content.
+		This is much cheaper than get_context, which most messages would otherwise go through for nothing.
+		"""
+		content = message.content
+		if not content:
+			return False
+		if not self._can_prefilter:
+			return True
+
+		if self.guild_prefixes is not None and message.guild is not None:
+			matcher = self.guild_prefixes.get(message.guild.id)
+		else:
+			matcher = self.prefix_matcher
+		if matcher is None:
+			# either a cold guild or we don't know our own mention yet, so let get_context decide
+			return True
+
+		prefix = matcher.match(content)
+		# a message that is only a prefix has no command name to invoke
+		return prefix is not None and len(prefix) < len(content)
+
 	def should_reply_to_bot(self, message):
 		should_reply = not self.config['ignore_bots'].get('default')
 		overrides = self.config['ignore_bots']['overrides']
@@ -186,16 +494,48 @@ class Bot(commands.AutoShardedBot):
 	### Init / Shutdown
 
 	def run(self, *, reconnect: bool = True):
+		try:
+			import uvloop
+		except ImportError:
+			pass  # Windows
+		else:
+			uvloop.install()
+
 		async def runner():
+			# close cleanly on SIGTERM too, which is how bot_bin.cluster and most service managers stop a process,
+			# so that batch writers are flushed and the pool is closed
+			with contextlib.suppress(NotImplementedError):  # Windows
+				asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(self.close()))
 			async with self:
 				await self.start(reconnect=reconnect)
 
+		listener = self.setup_logging()
 		try:
 			asyncio.run(runner())
 		except KeyboardInterrupt:
 			return
+		finally:
+			if listener is not None:
+				listener.stop()
+
+	def setup_logging(self):
+		"""Configure logging for Bot.run. Return a QueueListener that must be stopped at exit, or None.
+
+		If config['logging'] is set, it is passed to bot_bin.log.setup_logging as keyword arguments.
+		Otherwise, the root logger is set up to print INFO messages, unless it already has handlers.
+		"""
+		conf = self.config.get('logging')
+		if conf is None:
+			if not logging.getLogger().handlers:
+				logging.basicConfig(level=logging.INFO)
+			return None
+
+		from . import log
+		return log.setup_logging(**conf)
 
 	async def start(self, *, reconnect: bool = True):
+		if self._error_report_task is None:
+			self._error_report_task = asyncio.ensure_future(self._report_errors_periodically())
 		if self._should_setup_db:
 			await self.init_db()
 		await self.load_extensions()
@@ -205,30 +545,242 @@ class Bot(commands.AutoShardedBot):
 			reconnect=reconnect,
 		)
 
+	async def before_identify_hook(self, shard_id, *, initial=False):
+		if self._identify_scheduler is None:
+			await super().before_identify_hook(shard_id, initial=initial)
+			return
+		# other processes are identifying too, so even the initial shard may have to wait
+		await asyncio.sleep(self._identify_scheduler.reserve(shard_id))
+
 	async def close(self):
+		if self._error_report_task is not None:
+			self._error_report_task.cancel()
+			self._error_report_task = None
+		for writer in self.batch_writers:
+			try:
+				await writer.close()
+			except Exception:
+				logger.exception('failed to flush %r', writer)
+		if self.guild_prefixes is not None:
+			await self.guild_prefixes.close()
+		if self.replicas is not None:
+			await self.replicas.close()
 		if self._should_setup_db:
 			with contextlib.suppress(AttributeError):
 				await self.pool.close()
 		await super().close()
 
-	async def init_db(self):
+	async def init_db(self, *, json_codec=None):
+		"""Create self.pool from config['database'].
+
+		json_codec selects the library used to encode and decode json and jsonb values:
+		'orjson', 'msgspec', 'json' (the standard library), or 'auto' for the fastest one installed.
+		It defaults to config['json_codec'], or 'auto'.
+		"""
+		import asyncpg
+
 		credentials = self.config['database']
+		codec_name, encode, decode = get_json_codec(json_codec or self.config.get('json_codec', 'auto'))
+		logger.info('Using %s for JSON', codec_name)
 
-		async def set_connection_codecs(conn):
+		async def init(conn):
 			# https://magicstack.github.io/asyncpg/current/usage.html#example-automatic-json-conversion
-			for json_type in 'json', 'jsonb':
-				await conn.set_type_codec(
-					json_type,
-					encoder=json.dumps,
-					decoder=json.loads,
-					schema='pg_catalog',
-				)
-
-		self.pool = await asyncpg.create_pool(init=set_connection_codecs, **credentials)
+			# The binary format skips a round trip through str: json is sent as UTF-8 text,
+			# and jsonb as UTF-8 text after a version byte.
+			await conn.set_type_codec(
+				'json',
+				encoder=encode,
+				decoder=decode,
+				schema='pg_catalog',
+				format='binary',
+			)
+			await conn.set_type_codec(
+				'jsonb',
+				encoder=lambda obj: b'\x01' + encode(obj),
+				decoder=lambda data: decode(data[1:]),
+				schema='pg_catalog',
+				format='binary',
+			)
+			if self.queries is not None:
+				await self.queries.prepare(conn)
+			await self.init_connection(conn)
+
+		if self.queries is None and self.config.get('queries'):
+			from . import sql
+			# a path or a list of paths, to .sql files or directories of them
+			paths = self.config['queries']
+			self.queries = sql.Queries.from_path(*([paths] if isinstance(paths, str) else paths))
+
+		if self.config['query_stats'] is not None:
+			from . import sql
+			# e.g. {'slow_threshold': 0.5, 'max_statements': 1000}
+			for option, value in self.config['query_stats'].items():
+				setattr(sql.query_stats, option, value)
+			credentials = dict(credentials, connection_class=credentials.get('connection_class', sql.StatsConnection))
+			if not issubclass(credentials['connection_class'], sql.StatsConnection):
+				raise TypeError("config['query_stats'] requires the connection_class to subclass bot_bin.sql.StatsConnection")
+
+		# create_pool opens and initializes min_size connections before it returns,
+		# so they're all ready before the gateway connects
+		self.pool = await asyncpg.create_pool(init=init, **credentials)
+
+		# a list of connection options like config['database']'s, each of which may leave out what's the same
+		replicas_conf = self.config.get('read_replicas')
+		if replicas_conf:
+			from . import sql
+			replicas_conf = [dict(credentials, **replica) for replica in replicas_conf]
+			replica_pools = await asyncio.gather(
+				*(asyncpg.create_pool(init=init, **replica) for replica in replicas_conf),
+				return_exceptions=True,
+			)
+			# a replica which is down shouldn't stop the bot from starting: reads go to the others, or the primary
+			unreachable = []
+			for i, (replica, pool) in enumerate(zip(replicas_conf, replica_pools)):
+				if not isinstance(pool, BaseException):
+					continue
+				logger.warning('could not connect to read replica %d: %r', i, pool)
+				# a pool with no minimum size doesn't connect until it's used,
+				# so the health checks will find out when the replica is back
+				replica_pools[i] = await asyncpg.create_pool(init=init, **dict(replica, min_size=0))
+				unreachable.append(replica_pools[i])
+			self.replicas = sql.ReplicaSet(
+				replica_pools,
+				unhealthy=unreachable,
+				**self.config.get('read_replica_checks', {}),
+			)
+			self.replicas.start()
+
+		if self.config['guild_prefixes'] is not None:
+			self.guild_prefixes = GuildPrefixes(
+				self.pool,
+				matcher_factory=lambda prefixes: PrefixMatcher(self.prefixes(prefixes) or ()),
+				**self.config['guild_prefixes'],
+			)
+			await self.guild_prefixes.listen()
+
+	async def init_connection(self, conn):
+		"""Called with each new database connection, once its codecs are set up.
+		Override this to prepare statements or set session parameters on every connection.
+		"""
 
 	async def load_extensions(self):
-		for extension in self.startup_extensions:  # subclasses must define this
+		timings = {}
+
+		async def load(extension):
+			start = time.perf_counter()
 			await self.load_extension(extension)
+			timings[extension] = time.perf_counter() - start
+
+		extensions = self.startup_extensions  # subclasses must define this
+		if self.concurrent_extension_loading:
+			# import what each extension imports in worker threads,
+			# so that load_extension finds most of its dependencies already in sys.modules
+			await asyncio.gather(*(asyncio.to_thread(preload_dependencies, extension) for extension in extensions))
+			await asyncio.gather(*map(load, extensions))
+		else:
+			for extension in extensions:
+				await load(extension)
+
+		for extension, command_names in self.lazy_extensions.items():
+			self.add_lazy_extension(extension, command_names)
+
+		for extension, elapsed in sorted(timings.items(), key=lambda item: item[1], reverse=True):
+			logger.info('Loaded %s in %.1fms', extension, elapsed * 1000)
+
+	def add_lazy_extension(self, extension, command_names):
+		"""register stub commands which load an extension and then run the real command"""
+		command_names = list(command_names)
+		lock = asyncio.Lock()
+
+		async def load_and_invoke(ctx):
+			async with lock:
+				if extension not in self.extensions:
+					# the extension's commands have the same names
+					for name in command_names:
+						self.remove_command(name)
+					start = time.perf_counter()
+					try:
+						await self.load_extension(extension)
+					except BaseException:
+						# keep the stubs so that the next invocation tries again
+						add_stubs()
+						raise
+					logger.info('Loaded %s on demand in %.1fms', extension, (time.perf_counter() - start) * 1000)
+			# parse the message again, now that it resolves to the real command
+			await self.invoke(await self.get_context(ctx.message))
+
+		def add_stubs():
+			for name in command_names:
+				self.add_command(commands.Command(
+					load_and_invoke,
+					name=name,
+					ignore_extra=True,
+					help=f'This command is loaded from {extension} the first time it is used.',
+				))
+
+		add_stubs()
+
+def get_json_codec(name='auto'):
+	"""Return (name, encode, decode) for a JSON library. encode returns bytes and decode accepts bytes.
+
+	name may be 'orjson', 'msgspec', 'json', or 'auto' to pick the first of those that is installed.
+	"""
+	if name not in ('auto', 'orjson', 'msgspec', 'json'):
+		raise ValueError(f'unknown JSON codec {name!r}')
+
+	if name in ('auto', 'orjson'):
+		try:
+			import orjson
+		except ImportError:
+			if name == 'orjson':
+				raise
+		else:
+			# json.dumps accepts non-str keys, so keep accepting them
+			return 'orjson', functools.partial(orjson.dumps, option=orjson.OPT_NON_STR_KEYS), orjson.loads
+
+	if name in ('auto', 'msgspec'):
+		try:
+			import msgspec.json
+		except ImportError:
+			if name == 'msgspec':
+				raise
+		else:
+			return 'msgspec', msgspec.json.encode, msgspec.json.decode
+
+	import json
+	return 'json', lambda obj: json.dumps(obj).encode(), json.loads
+
+def preload_dependencies(name):
+	"""Import the modules that a module imports at the top level, without running the module itself.
+	Errors are ignored, so that load_extension reports them for the extension they belong to.
+	"""
+	def imports(body, package):
+		for node in body:
+			if isinstance(node, ast.Import):
+				yield from (alias.name for alias in node.names)
+			elif isinstance(node, ast.ImportFrom):
+				# e.g. a relative import beyond the top level package
+				with contextlib.suppress(ImportError, ValueError):
+					yield importlib.util.resolve_name('.' * node.level + (node.module or ''), package)
+			elif isinstance(node, (ast.If, ast.Try)):
+				# e.g. optional dependencies
+				yield from imports(node.body, package)
+
+	try:
+		spec = importlib.util.find_spec(name)
+		if spec is None or spec.loader is None:
+			return
+		source = spec.loader.get_source(name)
+		if source is None:
+			return
+		dependencies = list(imports(ast.parse(source).body, spec.parent))
+	# SyntaxError, or ImportError if a parent package is missing or broken
+	except Exception:
+		return
+
+	for dependency in dependencies:
+		with contextlib.suppress(Exception):
+			importlib.import_module(dependency)
 
 def convert_emoji(s) -> discord.PartialEmoji:
 	match = re.search(r'<?(a?):([A-Za-z0-9_]+):([0-9]{17,})>?', s)
@@ -0,0 +1,100 @@
+"""Building blocks shared by the database-backed caches in bot_bin.prefix and bot_bin.sql."""
+
+import asyncio
+import contextlib
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+class CoalescingLoader:
+	"""Runs at most one load per key at a time. Concurrent loads of the same key share the first one's result.
+
+	Every invalidation increments generation, and a load which raced with one does not store its result,
+	so that a result read before the invalidation is not cached after it.
+	"""
+
+	def __init__(self):
+		self._pending = {}
+		self.generation = 0
+
+	def __contains__(self, key):
+		"""whether key is being loaded"""
+		return key in self._pending
+
+	def invalidate(self):
+		self.generation += 1
+
+	async def load(self, key: Hashable, load: Callable[[], Awaitable[Any]], store: Callable[[Any], None]):
+		"""Return the result of load(), or of the load of key already in progress.
+		store(result) is called with the result unless an invalidation happened while loading it.
+		"""
+		try:
+			future = self._pending[key]
+		except KeyError:
+			future = self._pending[key] = asyncio.ensure_future(self._load(load, store))
+			future.add_done_callback(lambda _: self._pending.pop(key, None))
+		# shield so that one cancelled waiter does not cancel the load for the others
+		return await asyncio.shield(future)
+
+	async def _load(self, load, store):
+		generation = self.generation
+		result = await load()
+		if generation == self.generation:
+			store(result)
+		return result
+
+class NotifyListener:
+	"""Listens on a Postgres NOTIFY channel on a connection held from a pool, and reconnects if it's lost.
+
+	on_notify is called with the payload of each notification. Notifications sent while the connection was down
+	are missed, so on_lost is called when it's lost. name describes the listener in log messages.
+	"""
+
+	def __init__(self, pool, channel: str, *, on_notify: Callable[[str], Any], on_lost: Callable[[], Any], name: str):
+		self.pool = pool
+		self.channel = channel
+		self.on_notify = on_notify
+		self.on_lost = on_lost
+		self.name = name
+		self._conn = None
+		self._closed = False
+
+	def _on_notify(self, conn, pid, channel, payload):
+		self.on_notify(payload)
+
+	def _on_terminated(self, conn):
+		logger.warning('lost the %s connection, reconnecting', self.name)
+		self.on_lost()
+		asyncio.ensure_future(self._relisten(conn))
+
+	async def _relisten(self, conn):
+		self._conn = None
+		with contextlib.suppress(Exception):
+			await self.pool.release(conn)
+
+		delay = 1
+		while self._conn is None and not self._closed:
+			try:
+				await self.listen()
+			except Exception:
+				logger.exception('failed to reconnect the %s, retrying in %ds', self.name, delay)
+				await asyncio.sleep(delay)
+				delay = min(delay * 2, 60)
+
+	async def listen(self):
+		"""start listening. This holds one connection from the pool."""
+		conn = await self.pool.acquire()
+		await conn.add_listener(self.channel, self._on_notify)
+		conn.add_termination_listener(self._on_terminated)
+		self._conn = conn
+
+	async def close(self):
+		self._closed = True
+		conn, self._conn = self._conn, None
+		if conn is None:
+			return
+		conn.remove_termination_listener(self._on_terminated)
+		with contextlib.suppress(Exception):
+			await conn.remove_listener(self.channel, self._on_notify)
+		await self.pool.release(conn)
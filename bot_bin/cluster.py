@@ -0,0 +1,192 @@
+"""Run a Bot in several processes, each of which connects a slice of the shards.
+
+Example:
+
+	from bot_bin.cluster import Cluster
+	from mybot import MyBot  # a bot_bin.bot.Bot subclass
+
+	if __name__ == '__main__':
+		Cluster(MyBot, config=config, processes=4).run()
+
+The workers are started with the spawn method, so the bot class and any keyword arguments must be picklable,
+and the launching script must be guarded by `if __name__ == '__main__'`.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+import time
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_BOT_URL = 'https://discord.com/api/v10/gateway/bot'
+
+async def fetch_gateway_info(token) -> Tuple[int, int]:
+	"""return the recommended shard count and the identify concurrency for a bot token"""
+	import aiohttp
+
+	async with aiohttp.ClientSession() as session:
+		async with session.get(GATEWAY_BOT_URL, headers={'Authorization': 'Bot ' + token}) as resp:
+			resp.raise_for_status()
+			data = await resp.json()
+
+	return data['shards'], data['session_start_limit']['max_concurrency']
+
+class IdentifyScheduler:
+	"""Shares Discord's identify ratelimit between processes.
+
+	Shards identify in buckets of shard_id % max_concurrency, and each bucket may identify once per WINDOW seconds.
+	The next free time of each bucket lives in shared memory. The lock is only held while reserving a slot,
+	so a worker that crashes while waiting for its slot cannot block the others.
+	"""
+
+	WINDOW = 5.0
+
+	def __init__(self, max_concurrency, *, context=multiprocessing):
+		self.buckets = context.Array('d', max_concurrency)
+
+	def reserve(self, shard_id) -> float:
+		"""reserve the next identify slot for a shard, returning how long to wait until it"""
+		with self.buckets.get_lock():
+			bucket = shard_id % len(self.buckets)
+			now = time.time()
+			slot = max(now, self.buckets[bucket])
+			self.buckets[bucket] = slot + self.WINDOW
+		return slot - now
+
+def _run_worker(bot_cls, cluster_id, shard_ids, shard_count, identify_scheduler, bot_kwargs):
+	bot = bot_cls(
+		shard_ids=shard_ids,
+		shard_count=shard_count,
+		cluster_id=cluster_id,
+		identify_scheduler=identify_scheduler,
+		**bot_kwargs,
+	)
+	bot.run()
+
+def _raise_keyboard_interrupt(signum, frame):
+	raise KeyboardInterrupt
+
+class Cluster:
+	"""Supervises one process per slice of shards, restarting any that crash.
+
+	A worker which exits cleanly is not restarted. Workers which crash are restarted with exponential backoff,
+	which resets once a worker has stayed up for STABLE_AFTER seconds.
+	If shard_count or max_concurrency are not given, they are fetched from Discord.
+	Extra keyword arguments are passed to the bot class in every worker.
+	"""
+
+	STABLE_AFTER = 60.0
+	MAX_BACKOFF = 60.0
+	# how long a worker has to close after SIGTERM before it is killed
+	STOP_TIMEOUT = 30.0
+
+	def __init__(self, bot_cls, *, config, processes, shard_count=None, max_concurrency=None, **bot_kwargs):
+		self.bot_cls = bot_cls
+		self.config = config
+		self.processes = processes
+		self.shard_count = shard_count
+		self.max_concurrency = max_concurrency
+		self.bot_kwargs = bot_kwargs
+
+		self._context = multiprocessing.get_context('spawn')
+		self._workers = {}
+		self._started_at = {}
+		self._backoff = {}
+		self._restart_at = {}
+
+	def shard_ids(self, cluster_id):
+		"""return the shards run by a given worker. Each worker gets a contiguous slice."""
+		start = cluster_id * self.shard_count // self.processes
+		end = (cluster_id + 1) * self.shard_count // self.processes
+		return list(range(start, end))
+
+	def _start(self, cluster_id):
+		process = self._context.Process(
+			target=_run_worker,
+			args=(
+				self.bot_cls,
+				cluster_id,
+				self.shard_ids(cluster_id),
+				self.shard_count,
+				self._identify_scheduler,
+				dict(self.bot_kwargs, config=self.config),
+			),
+			name=f'cluster-{cluster_id}',
+		)
+		process.start()
+		self._workers[cluster_id] = process
+		self._started_at[cluster_id] = time.monotonic()
+		logger.info('started cluster %d (pid %d) with shards %s', cluster_id, process.pid, self.shard_ids(cluster_id))
+
+	def _on_exit(self, cluster_id):
+		process = self._workers.pop(cluster_id)
+		process.join()
+		if process.exitcode == 0:
+			logger.info('cluster %d exited cleanly', cluster_id)
+			return
+
+		uptime = time.monotonic() - self._started_at[cluster_id]
+		if uptime >= self.STABLE_AFTER:
+			self._backoff[cluster_id] = 1.0
+		else:
+			self._backoff[cluster_id] = min(self._backoff.get(cluster_id, 0.5) * 2, self.MAX_BACKOFF)
+		delay = self._backoff[cluster_id]
+		logger.error('cluster %d exited with code %s, restarting in %.0fs', cluster_id, process.exitcode, delay)
+		self._restart_at[cluster_id] = time.monotonic() + delay
+
+	def run(self):
+		if self.shard_count is None or self.max_concurrency is None:
+			shard_count, max_concurrency = asyncio.run(fetch_gateway_info(self.config['tokens']['discord']))
+			if self.shard_count is None:
+				self.shard_count = shard_count
+			if self.max_concurrency is None:
+				self.max_concurrency = max_concurrency
+		self.processes = min(self.processes, self.shard_count)
+		self._identify_scheduler = IdentifyScheduler(self.max_concurrency, context=self._context)
+
+		for cluster_id in range(self.processes):
+			self._start(cluster_id)
+
+		# stop the workers on SIGTERM as well, rather than leaving them running without a supervisor
+		previous_handler = signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+		try:
+			self._supervise()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			signal.signal(signal.SIGTERM, previous_handler)
+			self._stop()
+
+	def _supervise(self):
+		while self._workers or self._restart_at:
+			timeout = None
+			if self._restart_at:
+				timeout = max(0, min(self._restart_at.values()) - time.monotonic())
+
+			sentinels = {process.sentinel: cluster_id for cluster_id, process in self._workers.items()}
+			for sentinel in multiprocessing.connection.wait(list(sentinels), timeout):
+				self._on_exit(sentinels[sentinel])
+
+			now = time.monotonic()
+			for cluster_id, restart_at in list(self._restart_at.items()):
+				if restart_at <= now:
+					del self._restart_at[cluster_id]
+					self._start(cluster_id)
+
+	def _stop(self):
+		self._restart_at.clear()
+		# workers close the bot on SIGTERM
+		for process in self._workers.values():
+			process.terminate()
+		deadline = time.monotonic() + self.STOP_TIMEOUT
+		for cluster_id, process in self._workers.items():
+			process.join(max(0, deadline - time.monotonic()))
+			if process.exitcode is None:
+				logger.error('cluster %d did not exit within %.0fs, killing it', cluster_id, self.STOP_TIMEOUT)
+				process.kill()
+				process.join()
+		self._workers.clear()
@@ -1,23 +1,101 @@
+import asyncio
+import collections
 import contextlib
 import copy
 import functools
+import importlib.util
 import io
+import itertools
+import sys
 import time
 import traceback
 
 import discord
 from discord.ext import commands
-import humanize
-import objgraph
-try:
-	import psutil
-except (OSError, ImportError):
-	HAVE_PSUTIL = False
-else:
-	HAVE_PSUTIL = True
+from discord.state import ConnectionState
 
+from .metrics import span, spans
 from .misc import codeblock
 
+# humanize, objgraph and psutil are imported when they're first used, to keep importing this module fast
+HAVE_PSUTIL = importlib.util.find_spec('psutil') is not None
+
+# the objects that each of discord.py's caches is made of.
+# When measuring one cache, objects of the others' types are not followed, so that each object is counted once.
+_CACHE_TYPES = (
+	discord.Guild, discord.Member, discord.User, discord.ClientUser,
+	discord.Message, discord.Emoji, discord.GuildSticker,
+)
+_CONTAINER_TYPES = (list, tuple, set, frozenset, dict, collections.deque)
+
+def _deep_sizeof(roots, seen):
+	"""Return the total size of roots and of the discord.py objects and containers that they reference.
+	Objects in seen are skipped, and every object that is counted is added to it.
+	"""
+	total = 0
+	stack = list(roots)
+	root_ids = set(map(id, roots))
+	while stack:
+		obj = stack.pop()
+		if id(obj) in seen:
+			continue
+		if id(obj) not in root_ids and isinstance(obj, _CACHE_TYPES + (ConnectionState, discord.Client)):
+			continue
+		seen.add(id(obj))
+		total += sys.getsizeof(obj)
+
+		if isinstance(obj, dict):
+			stack.extend(obj.keys())
+			stack.extend(obj.values())
+		elif isinstance(obj, _CONTAINER_TYPES):
+			stack.extend(obj)
+		elif type(obj).__module__.startswith('discord.'):
+			# don't follow anything else (functions, modules, the event loop...), which would be shared
+			if hasattr(obj, '__dict__'):
+				stack.append(vars(obj))
+			for cls in type(obj).__mro__:
+				for slot in getattr(cls, '__slots__', ()):
+					with contextlib.suppress(AttributeError):
+						stack.append(getattr(obj, slot))
+	return total
+
+# how many cached objects cache_sizes measures before letting other tasks run
+_CACHE_SIZES_CHUNK = 1000
+
+async def cache_sizes(bot) -> dict:
+	"""Return a dict mapping the name of each of the bot's caches to (number of objects, approximate bytes used).
+
+	Each object is counted in the first cache that reaches it, so channels and roles count towards guilds,
+	and strings shared between caches are counted once. This walks every cached object, which takes a while
+	on large bots, so it yields to the event loop every _CACHE_SIZES_CHUNK objects to keep the shards' heartbeats going.
+	Objects added to a cache while it is being walked may not be counted.
+	"""
+	state = bot._connection
+	guilds = list(state._guilds.values())
+	caches = dict(
+		guilds=guilds,
+		# each guild's members are copied when they're reached, since the guild may change in the meantime
+		members=(member for guild in guilds for member in list(guild._members.values())),
+		users=list(state._users.values()),
+		emojis=list(state._emojis.values()),
+		stickers=list(state._stickers.values()),
+		messages=list(state._messages or ()),
+	)
+	seen = set()
+	sizes = {}
+	for name, objects in caches.items():
+		count = size = 0
+		objects = iter(objects)
+		while True:
+			chunk = list(itertools.islice(objects, _CACHE_SIZES_CHUNK))
+			if not chunk:
+				break
+			count += len(chunk)
+			size += _deep_sizeof(chunk, seen)
+			await asyncio.sleep(0)
+		sizes[name] = count, size
+	return sizes
+
 # Code provided by Rapptz under the MIT License
 # © 2015 Rapptz
 # https://github.com/Rapptz/RoboDanny/blob/d3148649ba504dcb6ca5499421bd397419ce7c1d/cogs/admin.py
@@ -69,8 +147,14 @@ class PerformanceMocker:
 
 class BotBinDebug(commands.Cog, command_attrs=dict(hidden=True)):
 	def __init__(self):
+		self.process = None
 		if HAVE_PSUTIL:
-			self.process = psutil.Process()
+			try:
+				import psutil
+			except (OSError, ImportError):
+				pass
+			else:
+				self.process = psutil.Process()
 
 	async def cog_check(self, context):
 		if not await context.bot.is_owner(context.author):
@@ -79,11 +163,13 @@ class BotBinDebug(commands.Cog, command_attrs=dict(hidden=True)):
 
 	@commands.command(name='most-common-types')
 	async def most_common_types(self, context):
+		import objgraph
 		await context.send(codeblock(await self.objgraph_show(objgraph.show_most_common_types)))
 
 	@commands.command()
 	async def objgrowth(self, context):
 		"""Show the increase in peak object counts since last call."""
+		import objgraph
 		await context.send(codeblock(await self.objgraph_show(objgraph.show_growth)))
 
 	async def objgraph_show(self, fn):
@@ -101,8 +187,65 @@ class BotBinDebug(commands.Cog, command_attrs=dict(hidden=True)):
 		await context.send(self.memory_usage(base1024=base1024))
 
 	def memory_usage(self, *, base1024=False):
+		import humanize
 		return humanize.naturalsize(self.process.memory_full_info().uss, binary=base1024)
 
+	@commands.command(name='command-latency')
+	async def command_latency(self, context, *, command=None):
+		"""Show command latency percentiles since startup.
+
+		Given a command name, show each phase of that command. Otherwise show the commands with the most total time.
+		"""
+		histograms = context.bot.command_timings.histograms
+		if command is not None:
+			rows = list(histograms.get(command, {}).items())
+		else:
+			rows = sorted(
+				((name, phases['total']) for name, phases in histograms.items() if 'total' in phases),
+				key=lambda row: row[1].total,
+				reverse=True,
+			)[:20]
+
+		if not rows:
+			await context.send('No timings recorded yet.')
+			return
+
+		ms = lambda seconds: f'{seconds * 1000:.1f}'
+		width = max(len(name) for name, _ in rows)
+		lines = [f'{"":{width}}  calls     p50     p95     p99  (ms)']
+		lines.extend(
+			f'{name:{width}}  {h.count:5}  {ms(h.percentile(50)):>6}  {ms(h.percentile(95)):>6}  {ms(h.percentile(99)):>6}'
+			for name, h in rows
+		)
+		await context.send(codeblock('\n'.join(lines)))
+
+	@commands.command(name='cache-sizes')
+	async def cache_sizes_command(self, context):
+		"""Show approximately how much memory each of discord.py's caches uses."""
+		import humanize
+
+		async with context.typing():
+			sizes = await cache_sizes(context.bot)
+		width = max(map(len, sizes))
+		await context.send(codeblock('\n'.join(
+			f'{name:{width}}  {count:>9,} objects  {humanize.naturalsize(size):>10}'
+			for name, (count, size) in sizes.items()
+		)))
+
+	@commands.command()
+	async def errors(self, context, count: int = 10):
+		"""Show the most frequent command errors since startup."""
+		groups = context.bot.error_groups.top(count)
+		if not groups:
+			await context.send('No errors recorded.')
+			return
+
+		await context.send('\n'.join(
+			f'**{group.count}×** `{group.type}` in `{group.command}` at `{group.location}`'
+			f' (first <t:{int(group.first_seen)}:R>, last <t:{int(group.last_seen)}:R>)'
+			for group in groups
+		)[:2000])
+
 	# Code provided by Rapptz under the MIT License
 	# © 2015 Rapptz
 	# https://github.com/Rapptz/RoboDanny/blob/d3148649ba504dcb6ca5499421bd397419ce7c1d/cogs/admin.py
@@ -128,7 +271,8 @@ class BotBinDebug(commands.Cog, command_attrs=dict(hidden=True)):
 
 		start = time.perf_counter()
 		try:
-			await new_context.command.invoke(new_context)
+			with span(new_context.command.qualified_name) as root:
+				await new_context.command.invoke(new_context)
 		except commands.CommandError:
 			end = time.perf_counter()
 			success = context.bot.config['success_emojis'][False]
@@ -138,11 +282,33 @@ class BotBinDebug(commands.Cog, command_attrs=dict(hidden=True)):
 			end = time.perf_counter()
 			success = context.bot.config['success_emojis'][True]
 
-		await context.send(f'Status: {success} Time: {(end - start) * 1000:.2f}ms')
+		message = f'Status: {success} Time: {(end - start) * 1000:.2f}ms'
+		# the spans which the command opened show where the time went
+		if root.children:
+			message += '\n' + codeblock(root.format_tree())
+		await context.send(message[:2000])
+
+	@commands.command(name='spans')
+	async def spans_command(self, context):
+		"""Show the durations of spans since startup."""
+		histograms = sorted(spans.histograms.items(), key=lambda item: item[1].total, reverse=True)[:20]
+		if not histograms:
+			await context.send('No spans recorded yet.')
+			return
+
+		ms = lambda seconds: f'{seconds * 1000:.1f}'
+		width = max(len(name) for name, _ in histograms)
+		lines = [f'{"":{width}}  count     p50     p99   total  (ms)']
+		lines.extend(
+			f'{name:{width}}  {h.count:5}  {ms(h.percentile(50)):>6}  {ms(h.percentile(99)):>6}  {ms(h.total):>6}'
+			for name, h in histograms
+		)
+		await context.send(codeblock('\n'.join(lines)))
 
 async def setup(bot):
-	await bot.add_cog(BotBinDebug())
+	cog = BotBinDebug()
+	await bot.add_cog(cog)
 
-	if not HAVE_PSUTIL:
+	if cog.process is None:
 		for command in 'objgrowth', 'most-common-types', 'mem':
 			bot.remove_command(command)
@@ -0,0 +1,110 @@
+import collections
+import functools
+import os.path
+import sysconfig
+import time
+import traceback
+from typing import List, Optional, Tuple
+
+# frames from files under these directories are library code, and don't help tell errors apart
+_LIBRARY_PATHS = tuple({
+	os.path.join(os.path.realpath(path), '')
+	for name, path in sysconfig.get_paths().items()
+	if name in ('stdlib', 'platstdlib', 'purelib', 'platlib')
+})
+
+@functools.lru_cache(maxsize=1024)
+def _is_library(filename):
+	return os.path.realpath(filename).startswith(_LIBRARY_PATHS)
+
+class ErrorGroup:
+	__slots__ = ('fingerprint', 'type', 'command', 'location', 'count', 'first_seen', 'last_seen', 'unreported', 'last_report')
+
+	def __init__(self, fingerprint, error, command, location):
+		self.fingerprint = fingerprint
+		self.type = type(error).__qualname__
+		self.command = command
+		self.location = location
+		self.count = 0
+		# wall clock, for display
+		self.first_seen = self.last_seen = time.time()
+		# occurrences since the last time this group was logged
+		self.unreported = 0
+		self.last_report = time.monotonic()
+
+class ErrorGroups:
+	"""A bounded table of exceptions, grouped by fingerprint.
+
+	The fingerprint is the exception type, the frames of the traceback which aren't library code, and the command name.
+	Computing it walks the traceback but does not format it, so repeats of a known error are cheap to count.
+	Once more than max_groups fingerprints have been seen, the least recently seen group is forgotten.
+	"""
+
+	def __init__(self, *, max_groups=500, summary_interval=60.0):
+		self.max_groups = max_groups
+		self.summary_interval = summary_interval
+		self._groups = collections.OrderedDict()
+
+	@staticmethod
+	def fingerprint(error: BaseException, command: Optional[str] = None) -> Tuple[tuple, Optional[str]]:
+		"""return the fingerprint of an exception and the innermost non-library location in its traceback"""
+		frames = [
+			(frame.f_code.co_filename, frame.f_code.co_name, lineno)
+			for frame, lineno in traceback.walk_tb(error.__traceback__)
+		]
+		ours = [frame for frame in frames if not _is_library(frame[0])]
+		if not ours:
+			ours = frames[-3:]
+
+		location = None
+		if ours:
+			filename, _, lineno = ours[-1]
+			location = f'{filename}:{lineno}'
+
+		return (type(error), tuple(ours), command), location
+
+	def record(self, error: BaseException, command: Optional[str] = None) -> Tuple[ErrorGroup, bool]:
+		"""count an occurrence of an exception. Return its group and whether it is the first of its group."""
+		fingerprint, location = self.fingerprint(error, command)
+		try:
+			group = self._groups[fingerprint]
+		except KeyError:
+			group = self._groups[fingerprint] = ErrorGroup(fingerprint, error, command, location)
+			if len(self._groups) > self.max_groups:
+				self._groups.popitem(last=False)
+			new = True
+		else:
+			self._groups.move_to_end(fingerprint)
+			group.unreported += 1
+			new = False
+
+		group.count += 1
+		group.last_seen = time.time()
+		return group, new
+
+	def pop_unreported(self, group: ErrorGroup) -> int:
+		"""If it's time to log the repeats of a group, return how many there were and reset the count.
+		Otherwise return 0.
+		"""
+		now = time.monotonic()
+		if not group.unreported or now - group.last_report < self.summary_interval:
+			return 0
+		group.last_report = now
+		unreported, group.unreported = group.unreported, 0
+		return unreported
+
+	def pop_all_unreported(self) -> List[Tuple[ErrorGroup, int]]:
+		"""pop_unreported for every group, returning the groups which are due to be logged and their counts"""
+		due = []
+		for group in self._groups.values():
+			unreported = self.pop_unreported(group)
+			if unreported:
+				due.append((group, unreported))
+		return due
+
+	def top(self, n=10) -> List[ErrorGroup]:
+		"""return the n groups with the most occurrences"""
+		return sorted(self._groups.values(), key=lambda group: group.count, reverse=True)[:n]
+
+	def clear(self):
+		self._groups.clear()
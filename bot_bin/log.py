@@ -0,0 +1,116 @@
+"""Non-blocking logging for the bot process.
+
+setup_logging() attaches a QueueHandler to the root logger, so that logging calls on the event loop thread
+only put records on a queue. A background thread formats the records and writes them out,
+so a slow stderr (such as a pipe to journald) can no longer stall the event loop.
+"""
+
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+class JSONFormatter(logging.Formatter):
+	"""Formats each record as one line of JSON."""
+
+	def format(self, record):
+		data = dict(
+			time=datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+			level=record.levelname,
+			logger=record.name,
+			message=record.getMessage(),
+		)
+		if record.exc_info:
+			data['exception'] = self.formatException(record.exc_info)
+		elif record.exc_text:
+			data['exception'] = record.exc_text
+		if record.stack_info:
+			data['stack'] = self.formatStack(record.stack_info)
+		return json.dumps(data, ensure_ascii=False)
+
+class RateLimitFilter(logging.Filter):
+	"""Lets through at most `rate` records per logger every `per` seconds.
+
+	overrides maps logger names to their own rate. Records at or above always_level are never dropped.
+	The number of records dropped from a logger is noted on the next record from it that gets through.
+	"""
+
+	def __init__(self, rate: int, per: float = 60.0, *, overrides: Dict[str, int] = None, always_level=logging.ERROR):
+		super().__init__()
+		self.rate = rate
+		self.per = per
+		self.overrides = overrides or {}
+		self.always_level = always_level
+		# logger name: [window start, records let through in this window, records dropped since the last one]
+		self._windows = {}
+		self._lock = threading.Lock()
+
+	def filter(self, record):
+		if record.levelno >= self.always_level:
+			return True
+
+		now = time.monotonic()
+		with self._lock:
+			window = self._windows.get(record.name)
+			if window is None or now - window[0] >= self.per:
+				dropped = window[2] if window is not None else 0
+				window = self._windows[record.name] = [now, 0, dropped]
+
+			if window[1] >= self.overrides.get(record.name, self.rate):
+				window[2] += 1
+				return False
+
+			window[1] += 1
+			dropped, window[2] = window[2], 0
+
+		if dropped:
+			record.msg = f'{record.msg} [{dropped} similar records dropped]'
+		return True
+
+class QueueHandler(logging.handlers.QueueHandler):
+	"""A QueueHandler which leaves formatting exceptions to the listener thread."""
+
+	def prepare(self, record):
+		# The base class formats the whole record, including any traceback, on the calling thread.
+		# Only merge the arguments into the message here, in case they are mutated after this call.
+		record = copy.copy(record)
+		record.msg = record.getMessage()
+		record.args = None
+		return record
+
+def setup_logging(
+	*,
+	level=logging.INFO,
+	json_output: bool = False,
+	rate: Optional[int] = None,
+	per: float = 60.0,
+	overrides: Dict[str, int] = None,
+	stream=None,
+) -> logging.handlers.QueueListener:
+	"""Send every record through a queue to a background thread which writes it to stream (stderr by default).
+
+	If json_output is True, each record is written as a line of JSON. If rate is given, see RateLimitFilter.
+	Returns the started listener. Call its stop() method at exit to write any records still in the queue.
+	"""
+	records = queue.SimpleQueue()
+
+	handler = logging.StreamHandler(stream)
+	handler.setFormatter(JSONFormatter() if json_output else logging.Formatter(logging.BASIC_FORMAT))
+	listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+
+	queue_handler = QueueHandler(records)
+	if rate is not None:
+		# filter before the queue, so that dropped records cost as little as possible
+		queue_handler.addFilter(RateLimitFilter(rate, per, overrides=overrides))
+
+	root = logging.getLogger()
+	root.addHandler(queue_handler)
+	root.setLevel(level)
+
+	listener.start()
+	return listener
@@ -0,0 +1,262 @@
+import collections
+import contextvars
+import functools
+import inspect
+import math
+import time
+from typing import Dict, List, Optional
+
+class Histogram:
+	"""A log-linear histogram of durations in seconds, using a fixed amount of memory.
+
+	Durations are kept with microsecond resolution in buckets no wider than 1/16 of their lower bound,
+	so percentiles are accurate to within about 6%. Durations longer than about 38 hours are clamped.
+	"""
+
+	__slots__ = ('counts', 'count', 'total', 'max')
+
+	SUB_BUCKET_BITS = 4
+	SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+	MAX_SHIFT = 32
+	BUCKETS = MAX_SHIFT * SUB_BUCKETS + 2 * SUB_BUCKETS
+	MAX_MICROSECONDS = (1 << (MAX_SHIFT + SUB_BUCKET_BITS + 1)) - 1
+
+	def __init__(self):
+		self.counts = [0] * self.BUCKETS
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	@classmethod
+	def _index(cls, microseconds):
+		if microseconds < 2 * cls.SUB_BUCKETS:
+			# small values get one bucket each
+			return microseconds
+		shift = microseconds.bit_length() - (cls.SUB_BUCKET_BITS + 1)
+		return shift * cls.SUB_BUCKETS + (microseconds >> shift)
+
+	@classmethod
+	def _bounds(cls, index):
+		"""return the lowest and highest+1 microsecond values of a bucket"""
+		if index < 2 * cls.SUB_BUCKETS:
+			return index, index + 1
+		shift = index // cls.SUB_BUCKETS - 1
+		mantissa = index - shift * cls.SUB_BUCKETS
+		return mantissa << shift, (mantissa + 1) << shift
+
+	def record(self, seconds: float):
+		microseconds = min(max(int(seconds * 1_000_000), 0), self.MAX_MICROSECONDS)
+		self.counts[self._index(microseconds)] += 1
+		self.count += 1
+		self.total += seconds
+		if seconds > self.max:
+			self.max = seconds
+
+	def percentile(self, percent: float) -> float:
+		"""return an estimate of the given percentile (0–100) in seconds"""
+		if not self.count:
+			return 0.0
+
+		rank = max(1, math.ceil(percent / 100 * self.count))
+		seen = 0
+		for index, count in enumerate(self.counts):
+			seen += count
+			if seen >= rank:
+				low, high = self._bounds(index)
+				return min((low + high) / 2 / 1_000_000, self.max)
+		return self.max
+
+	@property
+	def mean(self) -> float:
+		return self.total / self.count if self.count else 0.0
+
+	def merge(self, other: 'Histogram'):
+		"""add the values recorded in another histogram to this one"""
+		self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+		self.count += other.count
+		self.total += other.total
+		self.max = max(self.max, other.max)
+
+	def to_dict(self) -> Dict[str, float]:
+		return dict(
+			count=self.count,
+			total=self.total,
+			mean=self.mean,
+			max=self.max,
+			p50=self.percentile(50),
+			p95=self.percentile(95),
+			p99=self.percentile(99),
+		)
+
+	def __repr__(self):
+		return f'<{type(self).__name__} count={self.count} p50={self.percentile(50):.6f} max={self.max:.6f}>'
+
+class Timings:
+	"""Histograms of durations, keyed by a name (such as a command's qualified name) and then by phase."""
+
+	def __init__(self):
+		self.histograms = collections.defaultdict(dict)
+
+	def record(self, name: str, phase: str, seconds: float):
+		phases = self.histograms[name]
+		try:
+			histogram = phases[phase]
+		except KeyError:
+			histogram = phases[phase] = Histogram()
+		histogram.record(seconds)
+
+	def get(self, name: str, phase: str) -> Histogram:
+		return self.histograms.get(name, {}).get(phase)
+
+	def export(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+		"""return every histogram's summary as plain data, suitable for JSON"""
+		return {
+			name: {phase: histogram.to_dict() for phase, histogram in phases.items()}
+			for name, phases in self.histograms.items()
+		}
+
+	def clear(self):
+		self.histograms.clear()
+
+class Spans:
+	"""Histograms of the durations of spans, keyed by span name."""
+
+	def __init__(self):
+		self.histograms = {}
+
+	def record(self, name: str, seconds: float):
+		try:
+			histogram = self.histograms[name]
+		except KeyError:
+			histogram = self.histograms[name] = Histogram()
+		histogram.record(seconds)
+
+	def export(self) -> Dict[str, Dict[str, float]]:
+		return {name: histogram.to_dict() for name, histogram in self.histograms.items()}
+
+	def clear(self):
+		self.histograms.clear()
+
+# every finished span is recorded here
+spans = Spans()
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+def current_span() -> Optional['span']:
+	"""return the innermost span open in this task, if any"""
+	return _current_span.get()
+
+class span:
+	"""Times a block of code or a function call, as part of a tree of spans.
+
+		with span('db'):
+			rows = await conn.fetch(...)
+
+		@span('render')
+		def render(rows): ...
+
+	Spans opened while another is open in the same task, or in a task created while it was open, are its children,
+	so span trees follow awaits and concurrent tasks. Each finished span's duration is recorded in `spans` by name.
+	A span object times one block at a time, but it can decorate any number of functions.
+	"""
+
+	__slots__ = ('name', 'parent', 'children', 'dropped', 'start', 'end', '_token')
+
+	# a span with more children than this, such as one around a long loop, only counts the rest
+	MAX_CHILDREN = 1000
+
+	def __init__(self, name: str):
+		self.name = name
+		self.parent = None
+		self.children = []
+		# children which weren't kept because of MAX_CHILDREN
+		self.dropped = 0
+		self.start = self.end = None
+		self._token = None
+
+	def __enter__(self):
+		parent = _current_span.get()
+		# a task which outlives the span it was created in, such as a background loop started by a command,
+		# starts a tree of its own rather than growing its creator's (and keeping it alive) forever
+		if parent is not None and parent.end is None:
+			self.parent = parent
+			if len(parent.children) < self.MAX_CHILDREN:
+				parent.children.append(self)
+			else:
+				parent.dropped += 1
+		else:
+			self.parent = None
+		self._token = _current_span.set(self)
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *excinfo):
+		self.end = time.perf_counter()
+		try:
+			_current_span.reset(self._token)
+		except ValueError:
+			# exited in a different context than it was entered in, such as an async generator's finalizer
+			pass
+		self._token = None
+		spans.record(self.name, self.end - self.start)
+
+	def __call__(self, func):
+		name = self.name
+		if inspect.iscoroutinefunction(func):
+			@functools.wraps(func)
+			async def inner(*args, **kwargs):
+				with span(name):
+					return await func(*args, **kwargs)
+		else:
+			@functools.wraps(func)
+			def inner(*args, **kwargs):
+				with span(name):
+					return func(*args, **kwargs)
+		return inner
+
+	@property
+	def elapsed(self) -> float:
+		"""seconds taken so far, or in total once the span has finished"""
+		if self.start is None:
+			return 0.0
+		return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+	@property
+	def root(self) -> 'span':
+		node = self
+		while node.parent is not None:
+			node = node.parent
+		return node
+
+	def breakdown(self) -> Dict[str, float]:
+		"""return the time spent in this span's direct children, summed by name, and in the span itself as 'other'"""
+		totals = collections.Counter()
+		for child in self.children:
+			totals[child.name] += child.elapsed
+		# children which ran concurrently can add up to more than their parent
+		totals['other'] = max(0.0, self.elapsed - sum(totals.values()))
+		return dict(totals)
+
+	def format_tree(self) -> str:
+		"""return this span and its descendants as an indented tree, with sibling spans of the same name merged"""
+		lines = []
+		self._format(lines, 0, [self])
+		return '\n'.join(lines)
+
+	@staticmethod
+	def _format(lines, depth, group: List['span']):
+		elapsed = sum(node.elapsed for node in group)
+		count = f' ×{len(group)}' if len(group) > 1 else ''
+		lines.append(f'{"  " * depth}{group[0].name}{count}: {elapsed * 1000:.2f}ms')
+		children = collections.defaultdict(list)
+		for node in group:
+			for child in node.children:
+				children[child.name].append(child)
+		for child_group in children.values():
+			span._format(lines, depth + 1, child_group)
+		dropped = sum(node.dropped for node in group)
+		if dropped:
+			lines.append(f'{"  " * (depth + 1)}({dropped} more)')
+
+	def __repr__(self):
+		return f'<span {self.name!r} elapsed={self.elapsed:.6f}>'
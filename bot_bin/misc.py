@@ -2,21 +2,20 @@ import asyncio
 import collections
 import contextlib
 import datetime
+import functools
+import importlib.util
 import math
 import os.path
 import time
-from typing import Awaitable, Sequence, T, Tuple, Union
+import unicodedata
+from typing import Awaitable, Iterable, List, Optional, Sequence, T, Tuple, Union
 
 import discord
 import discord.utils
 from discord.ext import commands
-from dateutil.relativedelta import relativedelta
-try:
-	from prettytable import PrettyTable
-except ImportError:
-	HAVE_PRETTYTABLE = False
-else:
-	HAVE_PRETTYTABLE = True
+
+# dateutil and prettytable are imported when they're first used, to keep importing this module fast
+HAVE_PRETTYTABLE = importlib.util.find_spec('prettytable') is not None
 
 def codeblock(s, *, lang=''):
 	return f'```{lang}\n{s}```'
@@ -27,12 +26,27 @@ def absolute_natural_timedelta(seconds: Union[float, datetime.timedelta], *, acc
 	seconds = round(seconds)
 	if not seconds:
 		return '0 seconds'
+	return _absolute_natural_units(_largest_units(split_seconds(seconds), accuracy))
 
-	split = split_seconds(seconds)
+@functools.lru_cache(maxsize=4096)
+def _absolute_natural_units(split):
 	words = zip(('day', 'hour', 'minute', 'second'), split)
-	pluralized = [format(plural(value), word) for word, value in words if value][:accuracy]
+	pluralized = [format(plural(value), word) for word, value in words if value]
 	return natural_join(pluralized)
 
+def _largest_units(values, accuracy):
+	"""zero all but the first accuracy non-zero values, which are the only ones shown, to make a better cache key"""
+	if accuracy is None:
+		return tuple(values)
+	kept = []
+	for value in values:
+		if accuracy and value > 0:
+			accuracy -= 1
+			kept.append(value)
+		else:
+			kept.append(0)
+	return tuple(kept)
+
 def natural_rate(delta: Union[float, datetime.timedelta]):
 	"""return an english string representing a rate. delta is assumed to be a rate as "1 per delta"."""
 	if isinstance(delta, datetime.timedelta):
@@ -80,59 +94,65 @@ def natural_join(seq, sep=', ', conj='and'):
 
 	return sep.join(seq[:-1]) + f' {conj} {seq[-1]}'
 
+# every month is at least this long, so shorter deltas have no months or years, and can be split with divmod
+_CALENDAR_THRESHOLD = 28 * 24 * 60 * 60
+
+_UNITS = (
+	('year', 'y'),
+	('month', 'mo'),
+	('week', 'w'),
+	('day', 'd'),
+	('hour', 'h'),
+	('minute', 'm'),
+	('second', 's'),
+)
+
 def natural_timedelta(dt, *, source=None, accuracy=3, brief=False, ago=False):
 	now = source or discord.utils.utcnow()
 	# Microsecond free zone
 	now = now.replace(microsecond=0)
+	return _natural_timedelta(dt, now, accuracy, brief, ago)
+
+def natural_timedeltas(dts: Iterable[datetime.datetime], *, source=None, accuracy=3, brief=False, ago=False) -> List[str]:
+	"""format many datetimes with natural_timedelta, relative to the same source (now by default)"""
+	now = (source or discord.utils.utcnow()).replace(microsecond=0)
+	return [_natural_timedelta(dt, now, accuracy, brief, ago) for dt in dts]
+
+def _natural_timedelta(dt, now, accuracy, brief, ago):
 	dt = dt.replace(microsecond=0)
+	seconds = int((dt - now).total_seconds())
+	suffix = ' ago' if ago and seconds < 0 else ''
+	if abs(seconds) < _CALENDAR_THRESHOLD:
+		return _natural_seconds(abs(seconds), accuracy, brief, suffix)
+	return _join_units(_calendar_units(dt, now), accuracy, brief, suffix)
+
+def _natural_seconds(seconds, accuracy, brief, suffix):
+	days, hours, minutes, seconds = split_seconds(seconds)
+	weeks, days = divmod(days, 7)
+	return _join_units((0, 0, weeks, days, hours, minutes, seconds), accuracy, brief, suffix)
+
+def _calendar_units(dt, now):
+	from dateutil.relativedelta import relativedelta
 
 	# This implementation uses relativedelta instead of the much more obvious
 	# divmod approach with seconds because the seconds approach is not entirely
 	# accurate once you go over 1 week in terms of accuracy since you have to
 	# hardcode a month as 30 or 31 days.
 	# A query like "11 months" can be interpreted as "!1 months and 6 days"
-	if dt > now:
-		delta = relativedelta(dt, now)
-		suffix = ''
-	else:
-		delta = relativedelta(now, dt)
-		suffix = ' ago' if ago else ''
-
-	attrs = [
-		('year', 'y'),
-		('month', 'mo'),
-		('day', 'd'),
-		('hour', 'h'),
-		('minute', 'm'),
-		('second', 's'),
+	delta = relativedelta(dt, now) if dt > now else relativedelta(now, dt)
+	weeks = delta.weeks
+	return delta.years, delta.months, weeks, delta.days - weeks * 7, delta.hours, delta.minutes, delta.seconds
+
+def _join_units(values, accuracy, brief, suffix):
+	return _format_units(_largest_units(values, accuracy), brief, suffix)
+
+@functools.lru_cache(maxsize=4096)
+def _format_units(values, brief, suffix):
+	output = [
+		f'{value}{brief_unit}' if brief else format(plural(value), unit)
+		for value, (unit, brief_unit) in zip(values, _UNITS)
+		if value > 0
 	]
-
-	output = []
-	for attr, brief_attr in attrs:
-		elem = getattr(delta, attr + 's')
-		if not elem:
-			continue
-
-		if attr == 'day':
-			weeks = delta.weeks
-			if weeks:
-				elem -= weeks * 7
-				if not brief:
-					output.append(format(plural(weeks), 'week'))
-				else:
-					output.append(f'{weeks}w')
-
-		if elem <= 0:
-			continue
-
-		if brief:
-			output.append(f'{elem}{brief_attr}')
-		else:
-			output.append(format(plural(elem), attr))
-
-	if accuracy is not None:
-		output = output[:accuracy]
-
 	if not output:
 		return 'now'
 	if not brief:
@@ -164,8 +184,166 @@ class TimedReactor(contextlib.AbstractAsyncContextManager):
 	async def __aexit__(self, *excinfo):
 		self.task.cancel()
 
-if HAVE_PRETTYTABLE:
-	class PrettyTable(PrettyTable):
+@functools.lru_cache(maxsize=4096)
+def _char_width(char):
+	if unicodedata.combining(char):
+		return 0
+	return 2 if unicodedata.east_asian_width(char) in 'WF' else 1
+
+def display_width(s: str) -> int:
+	"""return how many columns of a monospace font s takes up"""
+	if s.isascii():
+		return len(s)
+	return sum(map(_char_width, s))
+
+def _truncate(s, width):
+	if display_width(s) <= width:
+		return s
+	if s.isascii():
+		return s[:width - 1] + '…'
+	used = 0
+	for i, char in enumerate(s):
+		used += _char_width(char)
+		if used > width - 1:
+			return s[:i] + '…'
+	return s
+
+def _wrap(s, width):
+	if s.isascii():
+		return [s[i:i + width] for i in range(0, len(s), width)] or ['']
+	lines = []
+	start = used = 0
+	for i, char in enumerate(s):
+		char_width = _char_width(char)
+		if used + char_width > width:
+			lines.append(s[start:i])
+			start, used = i, 0
+		used += char_width
+	lines.append(s[start:])
+	return lines
+
+def _pad(s, width):
+	return s + ' ' * (width - display_width(s))
+
+def _fit_widths(widths, available):
+	"""cap the widest columns so that the widths add up to at most available"""
+	if sum(widths) <= available:
+		return widths
+	remaining = available
+	ordered = sorted(widths)
+	for i, width in enumerate(ordered):
+		share = remaining // (len(ordered) - i)
+		if width > share:
+			cap = max(share, 1)
+			break
+		remaining -= width
+	return [min(width, cap) for width in widths]
+
+def _table_parts(rows, columns, max_width, wrap):
+	if columns is None and rows and hasattr(rows[0], 'keys'):
+		columns = list(rows[0].keys())
+
+	# a single pass over the rows converts every cell and measures the columns
+	header = [str(column) for column in columns] if columns else None
+	widths = [display_width(name) for name in header] if header else []
+	table = []
+	for row in rows:
+		# iterating over a Record or a tuple gives its values, but iterating over a dict gives its keys
+		cells = [str(value).replace('\n', ' ') for value in (row.values() if isinstance(row, dict) else row)]
+		if len(cells) > len(widths):
+			widths.extend([0] * (len(cells) - len(widths)))
+		for i, cell in enumerate(cells):
+			width = display_width(cell)
+			if width > widths[i]:
+				widths[i] = width
+		table.append(cells)
+
+	if max_width is not None:
+		# each column is padded by a space on each side, and there's a border between and around them
+		widths = _fit_widths(widths, max(max_width - 3 * len(widths) - 1, len(widths)))
+
+	def lines(cells):
+		cells = cells + [''] * (len(widths) - len(cells))
+		if not wrap:
+			return ['│ ' + ' │ '.join(_pad(_truncate(cell, width), width) for cell, width in zip(cells, widths)) + ' │']
+		wrapped = [_wrap(cell, width) for cell, width in zip(cells, widths)]
+		return [
+			'│ ' + ' │ '.join(
+				_pad(cell_lines[i] if i < len(cell_lines) else '', width)
+				for cell_lines, width in zip(wrapped, widths)
+			) + ' │'
+			for i in range(max(map(len, wrapped), default=1))
+		]
+
+	border = '┼' + '┼'.join('─' * (width + 2) for width in widths) + '┼'
+	header_lines = lines(header) + [border] if header else []
+	return border, header_lines, map(lines, table)
+
+def render_table(
+	rows: Sequence[Union['asyncpg.Record', dict, tuple]],
+	*,
+	columns: Optional[Sequence[str]] = None,
+	max_width: Optional[int] = None,
+	wrap=False,
+) -> str:
+	"""Render rows as a table which looks like PrettyTable's.
+
+	The column names are taken from the keys of the first row, if it has any, unless columns is given.
+	If max_width is given, the widest columns are narrowed until the table fits in that many characters,
+	and cells that don't fit are truncated with …, or wrapped onto more lines if wrap is True.
+	"""
+	border, header_lines, row_lines = _table_parts(rows, columns, max_width, wrap)
+	if not rows and not header_lines:
+		return ''
+	lines = [border, *header_lines]
+	for group in row_lines:
+		lines.extend(group)
+	lines.append(border)
+	return '\n'.join(lines)
+
+def paginate_table(
+	rows: Sequence[Union['asyncpg.Record', dict, tuple]],
+	*,
+	max_length=1900,
+	columns: Optional[Sequence[str]] = None,
+	max_width: Optional[int] = None,
+	wrap=False,
+) -> List[Tuple[str, int]]:
+	"""Render rows as tables of at most max_length characters each, with the same column widths and headers.
+	Return a list of (table, number of rows in it). A single row too long for a page is cut off.
+	Other options are as for render_table.
+	"""
+	border, header_lines, row_lines = _table_parts(rows, columns, max_width, wrap)
+	top = '\n'.join([border, *header_lines])
+	# the top, the bottom border, and the newlines before them
+	fixed = len(top) + len(border) + 1
+
+	pages = []
+	page = []
+	length = fixed
+
+	def finish():
+		text = '\n'.join([top, *page, border])
+		if len(text) > max_length:
+			text = text[:max_length - 1] + '…'
+		pages.append((text, len(page)))
+
+	for group in row_lines:
+		text = '\n'.join(group)
+		if page and length + len(text) + 1 > max_length:
+			finish()
+			page = []
+			length = fixed
+		page.append(text)
+		length += len(text) + 1
+	if page or not pages and header_lines:
+		finish()
+	return pages
+
+def _define_pretty_table():
+	import prettytable
+
+	class PrettyTable(prettytable.PrettyTable):
 		"""an extension of PrettyTable that works with asyncpg's Records and looks better"""
 		def __init__(self, rows: Sequence[Union['asyncpg.Record', collections.OrderedDict]], **options):
 			defaults = dict(
@@ -186,6 +364,17 @@ if HAVE_PRETTYTABLE:
 			for row in rows:
 				self.add_row(row)
 
+	PrettyTable.__qualname__ = 'PrettyTable'
+	return PrettyTable
+
+def __getattr__(name):
+	# PrettyTable subclasses prettytable's class, so it is only defined when it's first imported
+	if name == 'PrettyTable':
+		global PrettyTable
+		PrettyTable = _define_pretty_table()
+		return PrettyTable
+	raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 class BotBinMisc(commands.Cog):
 	"""Miscellaneous commands that don't belong in any other category"""
 
@@ -243,7 +432,11 @@ class BotBinMisc(commands.Cog):
 	async def ping(self, context):
 		"""Shows the bots latency to Discord's servers"""
 		latency = round(self.bot.latency * 1000, 2)
-		await context.send(f'🏓 Pong!│Average websocket latency: {latency}ms')
+		message = f'🏓 Pong!│Average websocket latency: {latency}ms'
+		monitor = self.bot.get_cog('BotBinMonitor')
+		if monitor is not None:
+			message += f'│Event loop lag: {monitor.summary()}'
+		await context.send(message)
 
 	@commands.command(hidden=True)
 	async def pong(self, context):
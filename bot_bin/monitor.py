@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from discord.ext import commands
+
+from .metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+class BotBinMonitor(commands.Cog, command_attrs=dict(hidden=True)):
+	"""Measures event loop lag, and logs where the event loop was stuck whenever it blocks.
+
+	A timer callback is scheduled every `interval` seconds, and how late it runs is recorded as the lag.
+	A watchdog thread checks that the timer keeps running. Once it is `threshold` seconds overdue,
+	the watchdog logs the event loop thread's current stack, which shows the callback that is blocking it.
+	Both are configured by bot.config['loop_monitor'], e.g. {'interval': 0.25, 'threshold': 0.5}.
+	"""
+
+	def __init__(self, bot):
+		self.bot = bot
+		config = bot.config.get('loop_monitor', {})
+		self.interval = config.get('interval', 0.25)
+		self.threshold = config.get('threshold', 0.5)
+
+		self.lag = Histogram()
+		self.stalls = 0
+
+		self._loop = asyncio.get_running_loop()
+		self._loop_thread_id = threading.get_ident()
+		self._last_tick = time.monotonic()
+		self._handle = self._loop.call_later(self.interval, self._tick, self._last_tick + self.interval)
+
+		self._stopped = threading.Event()
+		self._watchdog = threading.Thread(target=self._watch, name='event loop watchdog', daemon=True)
+		self._watchdog.start()
+
+	def cog_unload(self):
+		self._handle.cancel()
+		self._stopped.set()
+
+	def _tick(self, expected):
+		now = time.monotonic()
+		self.lag.record(max(0.0, now - expected))
+		self._last_tick = now
+		self._handle = self._loop.call_later(self.interval, self._tick, now + self.interval)
+
+	def _watch(self):
+		reported_tick = None
+		while not self._stopped.wait(self.threshold / 2):
+			last_tick = self._last_tick
+			overdue = time.monotonic() - last_tick - self.interval
+			# only report each stall once
+			if overdue < self.threshold or last_tick == reported_tick:
+				continue
+
+			reported_tick = last_tick
+			self.stalls += 1
+			frame = sys._current_frames().get(self._loop_thread_id)
+			if frame is None:
+				continue
+			stack = ''.join(traceback.format_stack(frame))
+			logger.warning('The event loop has been blocked for %.0fms, at:\n%s', overdue * 1000, stack)
+
+	def summary(self):
+		ms = lambda seconds: f'{seconds * 1000:.1f}ms'
+		return (
+			f'p50 {ms(self.lag.percentile(50))}, p99 {ms(self.lag.percentile(99))}, max {ms(self.lag.max)}, '
+			f'{self.stalls} stalls over {ms(self.threshold)}'
+		)
+
+	@commands.command()
+	async def lag(self, context):
+		"""Show how late the event loop has been running scheduled callbacks."""
+		await context.send(f'Event loop lag: {self.summary()}')
+
+async def setup(bot):
+	await bot.add_cog(BotBinMonitor(bot))
@@ -0,0 +1,147 @@
+import collections
+import logging
+from typing import Iterable, Optional
+
+from .cache import CoalescingLoader, NotifyListener
+
+logger = logging.getLogger(__name__)
+
+class PrefixMatcher:
+	"""An anchored, case insensitive prefix matcher.
+
+	The prefixes are compiled once into a trie whose root is a dispatch table keyed by the first character,
+	so a message which does not start with any prefix is rejected after looking at one character.
+	Matching a message costs at most O(longest prefix) lookups, plus a scan over any whitespace after the prefix.
+
+	Unlike an alternation regex, the longest matching prefix wins, regardless of the order the prefixes were given in.
+	"""
+
+	__slots__ = ('_root', 'prefixes')
+
+	# sentinel key marking the end of a prefix in a trie node
+	_END = None
+
+	def __init__(self, prefixes: Iterable[str]):
+		self.prefixes = tuple(prefixes)
+		self._root = root = {}
+		for prefix in self.prefixes:
+			node = root
+			# lower each character separately, the same way match() does
+			for c in prefix:
+				node = node.setdefault(c.lower(), {})
+			node[self._END] = True
+
+	def match(self, content: str) -> Optional[str]:
+		"""return the prefix of content, including any whitespace after it, or None if content has no prefix"""
+		END = self._END
+		node = self._root
+		end = 0 if END in node else None
+		for i, c in enumerate(content):
+			node = node.get(c.lower())
+			if node is None:
+				break
+			if END in node:
+				end = i + 1
+
+		if end is None:
+			return None
+
+		# equivalent to the \s* that the old regex matched after the prefix
+		length = len(content)
+		while end < length and content[end].isspace():
+			end += 1
+		# return the message's own text so that message.content.startswith(prefix) holds
+		return content[:end]
+
+	def __repr__(self):
+		return f'{type(self).__name__}({self.prefixes!r})'
+
+class GuildPrefixes:
+	"""Per-guild prefixes, loaded from the database and cached in memory as compiled PrefixMatchers.
+
+	The table must have at least these columns:
+
+		CREATE TABLE guild_prefixes (
+			guild_id BIGINT NOT NULL,
+			prefix TEXT NOT NULL,
+			PRIMARY KEY (guild_id, prefix));
+
+	Guilds with no rows use the global prefixes.
+	The cache is a bounded LRU. Every process that shares the database listens on a Postgres NOTIFY channel,
+	so that set() in one process invalidates the cached guild in all of them.
+	Concurrent cache misses for the same guild share a single query.
+	"""
+
+	def __init__(self, pool, *, matcher_factory, table='guild_prefixes', channel='guild_prefixes', cache_size=10_000):
+		self.pool = pool
+		# called with a guild's list of prefixes, or None if the guild should use the global prefixes
+		self.matcher_factory = matcher_factory
+		self.table = table
+		self.channel = channel
+		self.cache_size = cache_size
+
+		self._cache = collections.OrderedDict()
+		self._loader = CoalescingLoader()
+		self._listener = NotifyListener(
+			pool,
+			channel,
+			on_notify=lambda payload: self.invalidate(int(payload)),
+			# we may have missed notifications while the connection was down
+			on_lost=self.invalidate,
+			name='guild prefix listener',
+		)
+
+	def get(self, guild_id: int) -> Optional[PrefixMatcher]:
+		"""return the cached matcher for a guild without touching the database, or None if it's not cached"""
+		try:
+			matcher = self._cache[guild_id]
+		except KeyError:
+			return None
+		self._cache.move_to_end(guild_id)
+		return matcher
+
+	async def fetch(self, guild_id: int) -> PrefixMatcher:
+		"""return the matcher for a guild, loading it from the database if necessary"""
+		matcher = self.get(guild_id)
+		if matcher is not None:
+			return matcher
+
+		return await self._loader.load(
+			guild_id, lambda: self._load(guild_id), lambda matcher: self._store(guild_id, matcher),
+		)
+
+	async def _load(self, guild_id):
+		rows = await self.pool.fetch(f'SELECT prefix FROM {self.table} WHERE guild_id = $1', guild_id)
+		return self.matcher_factory([row['prefix'] for row in rows] or None)
+
+	def _store(self, guild_id, matcher):
+		self._cache[guild_id] = matcher
+		if len(self._cache) > self.cache_size:
+			self._cache.popitem(last=False)
+
+	async def set(self, guild_id: int, prefixes: Iterable[str]):
+		"""replace a guild's prefixes. An empty iterable resets the guild to the global prefixes."""
+		async with self.pool.acquire() as conn, conn.transaction():
+			await conn.execute(f'DELETE FROM {self.table} WHERE guild_id = $1', guild_id)
+			await conn.executemany(
+				f'INSERT INTO {self.table} (guild_id, prefix) VALUES ($1, $2)',
+				[(guild_id, prefix) for prefix in prefixes],
+			)
+			# delivered on commit, to every listener including this one
+			await conn.execute('SELECT pg_notify($1, $2)', self.channel, str(guild_id))
+		self.invalidate(guild_id)
+
+	def invalidate(self, guild_id: int = None):
+		"""forget the cached prefixes of one guild, or every guild if guild_id is None"""
+		self._loader.invalidate()
+		if guild_id is None:
+			self._cache.clear()
+		else:
+			self._cache.pop(guild_id, None)
+
+	async def listen(self):
+		"""start listening for invalidations from other processes. This holds one connection from the pool."""
+		await self._listener.listen()
+
+	async def close(self):
+		await self._listener.close()
@@ -1,56 +1,1169 @@
+import asyncio
+import collections
 import contextlib
 import functools
 import inspect
+import io
+import json
+import logging
+import os
+import re
+import time
+import weakref
+from typing import Any, Dict, Iterable, List, Literal, Optional, Sequence, Tuple
 
 import aiocontextvars
 import asyncpg
+import discord
 from discord.ext import commands
 
-from .misc import codeblock, timeit, PrettyTable
+from .bot import current_context
+from .cache import CoalescingLoader, NotifyListener
+from .metrics import Histogram, span
+from .misc import codeblock, paginate_table
+
+logger = logging.getLogger(__name__)
 
 _connection = aiocontextvars.ContextVar('connection')
 # make the interface a bit shorter
 connection = lambda: _connection.get()
 connection.set = _connection.set
 
-def optional_connection(func):
-	"""Decorator that acquires a connection for the decorated function if the contextvar is not set."""
+class PoolStats:
+	"""How long callers of optional_connection wait for connections from a pool, and how long they hold them.
+
+	Connections held for longer than leak_threshold seconds are logged when released, along with the function that
+	acquired them, and listed by held_too_long() while they're still held.
+	"""
+
+	def __init__(self, *, leak_threshold=10.0):
+		self.leak_threshold = leak_threshold
+		self.acquire_wait = Histogram()
+		self.hold = Histogram()
+		self.leaks = 0
+		# id(connection): (time acquired, acquiring function)
+		self._held = {}
+
+	def acquired(self, conn, call_site, wait):
+		self.acquire_wait.record(wait)
+		self._held[id(conn)] = time.perf_counter(), call_site
+
+	def released(self, conn):
+		acquired_at, call_site = self._held.pop(id(conn))
+		held = time.perf_counter() - acquired_at
+		self.hold.record(held)
+		if held > self.leak_threshold:
+			self.leaks += 1
+			logger.warning('%s held a database connection for %.1fs', call_site, held)
+
+	def held_too_long(self) -> List[Tuple[str, float]]:
+		"""return (acquiring function, seconds held) for each connection currently held for too long"""
+		now = time.perf_counter()
+		return sorted(
+			((call_site, now - acquired_at) for acquired_at, call_site in self._held.values() if now - acquired_at > self.leak_threshold),
+			key=lambda item: item[1],
+			reverse=True,
+		)
+
+# asyncpg pools can't be weakly referenced or given attributes, and they usually live as long as the process
+_pool_stats = {}
+
+def pool_stats(pool) -> PoolStats:
+	"""return the PoolStats of a pool"""
+	try:
+		return _pool_stats[id(pool)]
+	except KeyError:
+		stats = _pool_stats[id(pool)] = PoolStats()
+		return stats
+
+# whether the connection in the contextvar came from a read replica
+_readonly = aiocontextvars.ContextVar('readonly', default=False)
+
+def optional_connection(func=None, *, readonly=False):
+	"""Decorator that acquires a connection for the decorated function if the contextvar is not set.
+
+	With readonly=True, the connection is acquired from one of self.bot.replicas if there are any healthy ones.
+	A connection which is already set is used either way, except that a function which isn't read only
+	never uses a replica connection set by a read only function that called it.
+	Use it either as @optional_connection or as @optional_connection(readonly=True).
+	"""
+	if func is None:
+		return functools.partial(optional_connection, readonly=readonly)
+
+	call_site = f'{func.__module__}.{func.__qualname__}'
+
 	class pool:
-		def __init__(self, pool):
-			self.pool = pool
+		def __init__(self, bot):
+			self.bot = bot
 		async def __aenter__(self):
 			try:
 				# allow someone to call a decorated function twice within the same Task
 				# the second time, a new connection will be acquired
+				if connection() is None:
+					# unset by a cached_query load
+					raise LookupError
 				connection().is_closed()
+				if _readonly.get() and not readonly:
+					raise LookupError
 			except (asyncpg.InterfaceError, LookupError):
-				self.connection = conn = await self.pool.acquire()
-				connection.set(conn)
+				replicas = getattr(self.bot, 'replicas', None) if readonly else None
+				replica = replicas.choose() if replicas is not None else None
+				self.pool = replica if replica is not None else self.bot.pool
+
+				start = time.perf_counter()
+				try:
+					conn = await self.pool.acquire()
+				except (OSError, asyncpg.PostgresConnectionError, asyncio.TimeoutError):
+					if replica is None:
+						raise
+					# fall back to the primary until the next health check
+					replicas.mark_unhealthy(replica)
+					self.pool = self.bot.pool
+					conn = await self.pool.acquire()
+				self.connection = conn
+				self.stats = pool_stats(self.pool)
+				self.stats.acquired(conn, call_site, time.perf_counter() - start)
+				self.tokens = connection.set(conn), _readonly.set(self.pool is replica)
 				return conn
 			else:
 				return connection()
 		async def __aexit__(self, *excinfo):
 			with contextlib.suppress(AttributeError):
-				await self.pool.release(self.connection)
+				# an async generator may be finalized in another context
+				with contextlib.suppress(ValueError):
+					_connection.reset(self.tokens[0])
+					_readonly.reset(self.tokens[1])
+				try:
+					await self.pool.release(self.connection)
+				finally:
+					# a connection which failed to be released, such as a broken one, isn't held any more either
+					self.stats.released(self.connection)
 
 	if inspect.isasyncgenfunction(func):
 		@functools.wraps(func)
 		async def inner(self, *args, **kwargs):
-			async with pool(self.bot.pool) as conn:
+			async with pool(self.bot) as conn:
 				# this does not handle two-way async gens, but i don't have any of those either
 				async for x in func(self, *args, **kwargs):
 					yield x
 	else:
 		@functools.wraps(func)
 		async def inner(self, *args, **kwargs):
-			async with pool(self.bot.pool) as conn:
+			async with pool(self.bot) as conn:
 				return await func(self, *args, **kwargs)
 
 	return inner
 
+class ReplicaSet:
+	"""Read replica pools, which optional_connection(readonly=True) spreads connections across.
+
+	Each replica is checked every check_interval seconds. A replica which fails the check, or whose replay lag
+	is more than max_lag seconds, gets no connections until it passes again.
+	Connections go to the healthy replica with the fewest connections in use.
+	Pools in unhealthy, such as those of replicas which couldn't be reached at startup, start out unhealthy.
+	"""
+
+	def __init__(
+		self,
+		pools,
+		*,
+		unhealthy=(),
+		check_interval=5.0,
+		check_timeout=2.0,
+		max_lag: Optional[float] = None,
+	):
+		self.pools = list(pools)
+		self.check_interval = check_interval
+		self.check_timeout = check_timeout
+		self.max_lag = max_lag
+		self.healthy = [pool for pool in self.pools if pool not in unhealthy]
+		# for breaking ties between equally loaded replicas
+		self._next = 0
+		self._task = None
+
+	def choose(self):
+		"""return the replica pool to acquire from, or None if none are healthy"""
+		if not self.healthy:
+			return None
+		self._next = (self._next + 1) % len(self.healthy)
+		candidates = self.healthy[self._next:] + self.healthy[:self._next]
+		return min(candidates, key=lambda pool: pool.get_size() - pool.get_idle_size())
+
+	def mark_unhealthy(self, pool):
+		with contextlib.suppress(ValueError):
+			self.healthy.remove(pool)
+			logger.warning('read replica %d is unhealthy', self.pools.index(pool))
+
+	async def _check(self, pool):
+		try:
+			lag = await pool.fetchval(
+				'SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())',
+				timeout=self.check_timeout,
+			)
+		except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError, asyncio.TimeoutError) as exc:
+			logger.debug('read replica %d failed its health check: %r', self.pools.index(pool), exc)
+			return False
+		# lag is NULL on a server which isn't replaying anything
+		return lag is None or self.max_lag is None or lag <= self.max_lag
+
+	async def check(self):
+		"""check every replica now"""
+		results = await asyncio.gather(*map(self._check, self.pools))
+		for pool, ok in zip(self.pools, results):
+			if not ok:
+				self.mark_unhealthy(pool)
+			elif pool not in self.healthy:
+				logger.info('read replica %d is healthy again', self.pools.index(pool))
+				self.healthy.append(pool)
+
+	async def _check_periodically(self):
+		while True:
+			await asyncio.sleep(self.check_interval)
+			try:
+				await self.check()
+			except Exception:
+				logger.exception('read replica health check failed')
+
+	def start(self):
+		if self._task is None:
+			self._task = asyncio.ensure_future(self._check_periodically())
+
+	async def close(self):
+		if self._task is not None:
+			self._task.cancel()
+			self._task = None
+		await asyncio.gather(*(pool.close() for pool in self.pools), return_exceptions=True)
+
+# string and numeric literals, but not the digits of identifiers or $1 style parameters
+_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w$])\d+(?:\.\d+)?")
+_LITERAL_LISTS = re.compile(r'\(\?(?:\s*,\s*\?)+\)')
+_WHITESPACE = re.compile(r'\s+')
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(query: str) -> str:
+	"""normalize a query, so that queries which only differ in literals and whitespace are counted together"""
+	query = _LITERALS.sub('?', query)
+	query = _LITERAL_LISTS.sub('(?, ...)', query)
+	return _WHITESPACE.sub(' ', query).strip()
+
+class StatementStats:
+	__slots__ = ('query', 'calls', 'total', 'max', 'rows')
+
+	def __init__(self, query):
+		self.query = query
+		self.calls = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.rows = 0
+
+	@property
+	def mean(self):
+		return self.total / self.calls if self.calls else 0.0
+
+class QueryStats:
+	"""Client-side statistics per normalized statement, like pg_stat_statements, recorded by StatsConnection.
+
+	Times include sending the query and receiving the results, but not waiting for a connection from the pool.
+	Queries which take at least slow_threshold seconds are logged along with the command that ran them.
+	Once more than max_statements fingerprints have been seen, the least recently run one is forgotten.
+	"""
+
+	def __init__(self, *, slow_threshold=0.5, max_statements=1000):
+		self.slow_threshold = slow_threshold
+		self.max_statements = max_statements
+		self.slow = 0
+		self._statements = collections.OrderedDict()
+
+	def record(self, query, elapsed, rows):
+		key = fingerprint(query)
+		try:
+			stats = self._statements[key]
+		except KeyError:
+			stats = self._statements[key] = StatementStats(key)
+			if len(self._statements) > self.max_statements:
+				self._statements.popitem(last=False)
+		else:
+			self._statements.move_to_end(key)
+
+		stats.calls += 1
+		stats.total += elapsed
+		stats.max = max(stats.max, elapsed)
+		stats.rows += rows
+
+		if elapsed >= self.slow_threshold:
+			self.slow += 1
+			logger.warning('slow query (%.0fms) %s: %s', elapsed * 1000, self._caller(), key)
+
+	@staticmethod
+	def _caller():
+		context = current_context.get()
+		if context is None or context.command is None:
+			return 'outside of any command'
+		cog = context.cog.qualified_name if context.cog is not None else 'no cog'
+		return f'in command {context.command.qualified_name} ({cog})'
+
+	def top(self, n=10) -> List[StatementStats]:
+		"""return the n statements with the highest total time"""
+		return sorted(self._statements.values(), key=lambda stats: stats.total, reverse=True)[:n]
+
+	def clear(self):
+		self.slow = 0
+		self._statements.clear()
+
+query_stats = QueryStats()
+
+class StatsConnection(asyncpg.Connection):
+	"""A Connection which records the time taken and rows returned by each query in query_stats.
+
+	Use it as the connection_class of a pool, or set config['query_stats'] to have Bot.init_db do so.
+	Cursors and prepared statements are not timed.
+	"""
+
+	async def _timed(self, method, query, args, kwargs, count_rows):
+		start = time.perf_counter()
+		rows = 0
+		try:
+			result = await method(query, *args, **kwargs)
+			rows = count_rows(result)
+			return result
+		finally:
+			query_stats.record(query, time.perf_counter() - start, rows)
+
+	async def execute(self, query, *args, **kwargs):
+		# the pool resets connections when they're released, which isn't a query anyone ran
+		if not args and query == self.get_reset_query():
+			return await super().execute(query, **kwargs)
+		return await self._timed(super().execute, query, args, kwargs, lambda result: 0)
+
+	async def executemany(self, command, args, **kwargs):
+		return await self._timed(super().executemany, command, (args,), kwargs, lambda result: 0)
+
+	async def fetch(self, query, *args, **kwargs):
+		return await self._timed(super().fetch, query, args, kwargs, len)
+
+	async def fetchrow(self, query, *args, **kwargs):
+		return await self._timed(super().fetchrow, query, args, kwargs, lambda row: row is not None)
+
+	async def fetchval(self, query, *args, **kwargs):
+		return await self._timed(super().fetchval, query, args, kwargs, lambda value: 1)
+
+def _can_rewrap_statements():
+	# Queries.statement creates a PreparedStatement from another's private state, which works in asyncpg 0.30 to 0.32.
+	# If a later version changes that, queries are run through the connection's statement cache instead.
+	try:
+		parameters = list(inspect.signature(asyncpg.prepared_stmt.PreparedStatement).parameters)
+	except (AttributeError, TypeError, ValueError):
+		return False
+	return parameters == ['connection', 'query', 'state']
+
+_REWRAP_STATEMENTS = _can_rewrap_statements()
+
+class Query:
+	"""A named query from a .sql file. Call it with the query's arguments to run it."""
+
+	# the suffix of a query's name decides how it's run, as in aiosql
+	METHODS = {'': 'fetch', '^': 'fetchrow', '$': 'fetchval', '!': 'execute', '*!': 'executemany'}
+
+	def __init__(self, queries, name, method, sql, doc, source):
+		self._queries = queries
+		self.name = name
+		self.method = method
+		self.sql = sql
+		self.__doc__ = doc
+		self.source = source
+		self.timings = Histogram()
+
+	async def __call__(self, *args, conn=None):
+		"""Run the query on conn, or the connection acquired by optional_connection.
+		For executemany queries, pass an iterable of argument tuples.
+		"""
+		if conn is None:
+			try:
+				conn = connection()
+			except LookupError:
+				raise RuntimeError(f'query {self.name} needs conn, or to be run in an optional_connection function') from None
+
+		start = time.perf_counter()
+		if not _REWRAP_STATEMENTS:
+			# asyncpg's own statement cache still prepares the query once per connection
+			try:
+				return await getattr(conn, self.method)(self.sql, *args)
+			finally:
+				self.timings.record(time.perf_counter() - start)
+
+		statement = await self._queries.statement(conn, self.name)
+		try:
+			if self.method == 'execute':
+				await statement.fetch(*args)
+				return statement.get_statusmsg()
+			return await getattr(statement, self.method)(*args)
+		finally:
+			self.timings.record(time.perf_counter() - start)
+
+	def __repr__(self):
+		return f'<Query {self.name} ({self.method}) from {self.source}>'
+
+class Queries:
+	"""Named queries loaded from .sql files, in the style of aiosql, which are prepared on every connection.
+
+	Each query starts with a comment naming it, optionally followed by comments that describe it:
+
+		-- name: guild_settings^
+		-- Get the settings of one guild.
+		SELECT * FROM guild_settings WHERE guild_id = $1;
+
+	The suffix of the name decides what calling the query returns: none for fetch, ^ for fetchrow, $ for fetchval,
+	! for execute, and *! for executemany. Queries are accessed as attributes, e.g. `await queries.guild_settings(id)`.
+
+	prepare(conn) must be called on every connection, which Bot.init_db does for bot.queries.
+	It prepares every query, so a query with a syntax error, or which refers to a missing table, fails at startup.
+	"""
+
+	_NAME = re.compile(r'^--\s*name:\s*(?P<name>[\w-]+)(?P<suffix>\*!|[$^!])?\s*$', re.MULTILINE)
+
+	def __init__(self):
+		self._queries = {}
+		# connection: {query name: PreparedStatement}
+		# Each statement refers to its connection, so this can't be a WeakKeyDictionary.
+		# Instead, closed connections are forgotten whenever a new one is prepared.
+		self._statements = {}
+
+	@classmethod
+	def from_path(cls, *paths: str) -> 'Queries':
+		"""load every query in the given .sql files, or in the .sql files directly in the given directories"""
+		self = cls()
+		for path in paths:
+			if os.path.isdir(path):
+				for filename in sorted(os.listdir(path)):
+					if filename.endswith('.sql'):
+						self.load_file(os.path.join(path, filename))
+			else:
+				self.load_file(path)
+		return self
+
+	def load_file(self, path: str):
+		with open(path, encoding='utf-8') as f:
+			self.load_str(f.read(), source=path)
+
+	def load_str(self, text: str, *, source='<string>'):
+		matches = list(self._NAME.finditer(text))
+		if not matches and text.strip():
+			raise ValueError(f'{source} has no -- name: comments')
+
+		for match, next_match in zip(matches, matches[1:] + [None]):
+			name = match['name'].replace('-', '_')
+			if name in self._queries:
+				raise ValueError(f'query {name} in {source} is already defined in {self._queries[name].source}')
+			if name.startswith('_') or hasattr(type(self), name):
+				raise ValueError(f'query {name} in {source} has a reserved name')
+
+			body = text[match.end():next_match.start() if next_match is not None else len(text)].strip()
+			doc = []
+			lines = body.splitlines()
+			while lines and lines[0].lstrip().startswith('--'):
+				doc.append(lines.pop(0).lstrip()[2:].strip())
+			sql = '\n'.join(lines).strip()
+			if not sql:
+				raise ValueError(f'query {name} in {source} is empty')
+
+			method = Query.METHODS[match['suffix'] or '']
+			self._queries[name] = Query(self, name, method, sql, '\n'.join(doc) or None, source)
+
+	def __getattr__(self, name) -> Query:
+		try:
+			return self.__dict__['_queries'][name]
+		except KeyError:
+			raise AttributeError(f'no query named {name!r}') from None
+
+	def __iter__(self) -> Iterable[Query]:
+		return iter(self._queries.values())
+
+	def __len__(self):
+		return len(self._queries)
+
+	async def prepare(self, conn):
+		"""prepare every query on a new connection"""
+		for closed in [closed for closed in self._statements if closed.is_closed()]:
+			del self._statements[closed]
+
+		statements = {}
+		for query in self._queries.values():
+			statements[query.name] = await self._prepare(conn, query)
+		self._statements[self._unwrap(conn)] = statements
+
+	@staticmethod
+	async def _prepare(conn, query):
+		try:
+			return await conn.prepare(query.sql)
+		except asyncpg.PostgresError as exc:
+			raise ValueError(f'failed to prepare query {query.name} from {query.source}: {type(exc).__name__}: {exc}') from exc
+
+	@staticmethod
+	def _unwrap(conn):
+		# pool.acquire() returns a proxy, which changes on every acquisition
+		unwrapped = getattr(conn, '_con', conn)
+		if unwrapped is None:
+			raise RuntimeError('this connection has been released to the pool')
+		return unwrapped
+
+	async def statement(self, conn, name) -> asyncpg.prepared_stmt.PreparedStatement:
+		"""return the prepared statement of a query on a connection that has been through prepare()"""
+		conn = self._unwrap(conn)
+		try:
+			statements = self._statements[conn]
+		except KeyError:
+			raise RuntimeError('this connection was not set up with Queries.prepare') from None
+
+		prepared = statements[name]
+		if prepared._state.closed:
+			# asyncpg closes statements whose types or codecs have changed
+			prepared = statements[name] = await self._prepare(conn, self._queries[name])
+		# A PreparedStatement can't be used once its connection has been released to the pool, but the statement
+		# on the server can be, so it's wrapped again for each use. The original keeps the statement from being closed.
+		return asyncpg.prepared_stmt.PreparedStatement(conn, self._queries[name].sql, prepared._state)
+
+class CachedQuery:
+	"""The cache of a function decorated with cached_query.
+
+	Results are keyed by the function's arguments, excluding self, and kept for ttl seconds
+	in a LRU of at most maxsize entries. Concurrent misses for the same arguments share a single call.
+	"""
+
+	def __init__(self, func, *, ttl, maxsize, tags):
+		self.func = func
+		self.name = f'{func.__module__}.{func.__qualname__}'
+		self.ttl = ttl
+		self.maxsize = maxsize
+		self.tags = frozenset(tags)
+
+		self.hits = 0
+		self.misses = 0
+		# misses which waited for another caller's query instead of running their own
+		self.coalesced = 0
+
+		# key: (expiry time, result)
+		self._cache = collections.OrderedDict()
+		self._loader = CoalescingLoader()
+
+	@staticmethod
+	def _key(args, kwargs):
+		return (args, tuple(sorted(kwargs.items()))) if kwargs else args
+
+	async def get(self, instance, args, kwargs):
+		key = self._key(args, kwargs)
+		try:
+			expires, result = self._cache[key]
+		except KeyError:
+			pass
+		else:
+			if expires > time.monotonic():
+				self._cache.move_to_end(key)
+				self.hits += 1
+				return result
+			del self._cache[key]
+
+		if key in self._loader:
+			self.coalesced += 1
+		else:
+			self.misses += 1
+		return await self._loader.load(
+			key, lambda: self._load(instance, args, kwargs), lambda result: self._store(key, result),
+		)
+
+	async def _load(self, instance, args, kwargs):
+		# The result is shared with every caller waiting for it, so it mustn't be read on the first caller's
+		# connection, which may be in a transaction, or released while the load is still using it.
+		# The load runs in a task with its own copy of the context, so this doesn't affect the caller.
+		_connection.set(None)
+		_readonly.set(False)
+		return await self.func(instance, *args, **kwargs)
+
+	def _store(self, key, result):
+		self._cache[key] = time.monotonic() + self.ttl, result
+		if len(self._cache) > self.maxsize:
+			self._cache.popitem(last=False)
+
+	def invalidate(self, *args, **kwargs):
+		"""forget the cached result for the given arguments, or every result if none are given"""
+		self._loader.invalidate()
+		if args or kwargs:
+			self._cache.pop(self._key(args, kwargs), None)
+		else:
+			self._cache.clear()
+
+	def stats(self) -> Dict[str, Any]:
+		return dict(size=len(self._cache), hits=self.hits, misses=self.misses, coalesced=self.coalesced)
+
+# every live cache, so that they can be invalidated by tag
+_caches = weakref.WeakSet()
+
+def cached_query(*, ttl=60.0, maxsize=1024, tags=()):
+	"""Decorator that caches the results of a method which runs a read-only query.
+
+	Place it above optional_connection, so that cache hits don't acquire a connection:
+
+		@cached_query(ttl=300, tags=['guild_settings'])
+		@optional_connection
+		async def guild_settings(self, guild_id):
+			return await connection().fetchrow('SELECT * FROM guild_settings WHERE guild_id = $1', guild_id)
+
+	Arguments must be hashable. Results are shared between callers, so they must not be mutated.
+	For the same reason, a miss never runs on the caller's connection, even inside another optional_connection function.
+	The CachedQuery is available as the cache attribute of the decorated function.
+	"""
+	def decorator(func):
+		cache = CachedQuery(func, ttl=ttl, maxsize=maxsize, tags=tags)
+		_caches.add(cache)
+
+		@functools.wraps(func)
+		async def inner(self, *args, **kwargs):
+			return await cache.get(self, args, kwargs)
+
+		inner.cache = cache
+		return inner
+
+	return decorator
+
+def invalidate(tag: str = None):
+	"""forget every result of every cached query with the given tag, or of every cached query if tag is None"""
+	for cache in list(_caches):
+		if tag is None or tag in cache.tags:
+			cache.invalidate()
+
+INVALIDATION_CHANNEL = 'bot_bin_query_cache'
+
+async def notify_invalidation(conn, tag: str, *, channel=INVALIDATION_CHANNEL):
+	"""invalidate a tag in every process running an InvalidationListener, including this one.
+	If conn is in a transaction, the notification is sent when it commits.
+	"""
+	invalidate(tag)
+	await conn.execute('SELECT pg_notify($1, $2)', channel, tag)
+
+class InvalidationListener(NotifyListener):
+	"""Listens on a Postgres NOTIFY channel for tags sent by notify_invalidation, and invalidates them.
+	If the listening connection is lost, every cache is cleared, since notifications may have been missed.
+	"""
+
+	def __init__(self, pool, *, channel=INVALIDATION_CHANNEL):
+		super().__init__(
+			pool,
+			channel,
+			on_notify=invalidate,
+			on_lost=invalidate,
+			name='query cache invalidation listener',
+		)
+
+# errors caused by the rows of a batch. asyncpg's client-side DataError, raised for values it can't encode,
+# is an InterfaceError and a ValueError, so these are checked before _TRANSIENT_ERRORS.
+_ROW_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError, ValueError, TypeError)
+# errors after which the same batch may well succeed
+_TRANSIENT_ERRORS = (
+	OSError,
+	asyncio.TimeoutError,
+	asyncpg.InterfaceError,
+	asyncpg.PostgresConnectionError,
+	asyncpg.TransactionRollbackError,
+	asyncpg.OperatorInterventionError,
+	asyncpg.InsufficientResourcesError,
+)
+
+class BatchWriter:
+	"""Buffers rows for a table in memory and writes them in batches, each in one transaction.
+
+	Rows are written with COPY once max_rows are buffered or every interval seconds, whichever comes first.
+	If key_columns is given, rows with the same key are merged in memory by adding up their other columns,
+	and written with INSERT ... ON CONFLICT (key_columns) DO UPDATE, which adds them to the existing row.
+	This requires a unique index on key_columns.
+
+	Once max_buffered rows (or keys) are waiting, add() waits for a flush to finish, which slows down
+	the callers rather than letting the buffer grow without bound. If there's still no room after max_wait seconds,
+	the row is dropped.
+
+	A batch which failed because of the connection or the server, rather than its rows, is put back in the buffer
+	to be retried, as far as there is room for it. A batch with rows the database rejects is split in halves,
+	each written on its own, until the rejected rows are found, which are logged and dropped.
+	A batch which fails for any other reason, such as a missing table, is dropped.
+
+	Add writers to bot.batch_writers so that they are flushed when the bot closes.
+	"""
+
+	def __init__(
+		self,
+		pool,
+		table: str,
+		columns: Sequence[str],
+		*,
+		key_columns: Optional[Sequence[str]] = None,
+		schema: Optional[str] = None,
+		max_rows=1000,
+		max_buffered=10_000,
+		interval=1.0,
+		max_wait=10.0,
+	):
+		self.pool = pool
+		self.table = table
+		self.columns = tuple(columns)
+		self.key_columns = tuple(key_columns) if key_columns is not None else None
+		self.schema = schema
+		self.max_rows = max_rows
+		self.max_buffered = max_buffered
+		self.interval = interval
+		self.max_wait = max_wait
+
+		if self.key_columns is not None:
+			self._key_indices = [self.columns.index(column) for column in self.key_columns]
+			self._value_indices = [i for i, column in enumerate(self.columns) if column not in self.key_columns]
+			# key: list of values for the other columns
+			self._buffer = {}
+			self._upsert_query = self._build_upsert_query()
+		else:
+			self._buffer = []
+
+		self.rows_written = 0
+		self.dropped = 0
+		self.flush_times = Histogram()
+
+		self._lock = asyncio.Lock()
+		self._task = None
+		self._closed = False
+
+	def _build_upsert_query(self):
+		table = f'{self.schema}.{self.table}' if self.schema else self.table
+		placeholders = ', '.join(f'${i}' for i in range(1, len(self.columns) + 1))
+		updates = ', '.join(
+			f'{self.columns[i]} = target.{self.columns[i]} + EXCLUDED.{self.columns[i]}'
+			for i in self._value_indices
+		)
+		return (
+			f'INSERT INTO {table} AS target ({", ".join(self.columns)}) VALUES ({placeholders}) '
+			f'ON CONFLICT ({", ".join(self.key_columns)}) DO UPDATE SET {updates}'
+		)
+
+	def __len__(self):
+		return len(self._buffer)
+
+	async def add(self, *values):
+		"""buffer a row, given in the order of columns"""
+		if self._closed:
+			raise RuntimeError('this BatchWriter is closed')
+		if len(values) != len(self.columns):
+			raise TypeError(f'expected {len(self.columns)} values, got {len(values)}')
+
+		if self._task is None:
+			self._task = asyncio.ensure_future(self._flush_periodically())
+		deadline = time.monotonic() + self.max_wait
+		while len(self._buffer) >= self.max_buffered:
+			if time.monotonic() >= deadline:
+				self.dropped += 1
+				logger.warning('dropped a row for %s after waiting %.0fs for room in the buffer', self.table, self.max_wait)
+				return
+			if not await self.flush():
+				# don't retry a failing database in a tight loop
+				await asyncio.sleep(min(self.interval, max(0, deadline - time.monotonic())))
+
+		self._merge(values)
+		if len(self._buffer) >= self.max_rows and not self._lock.locked():
+			asyncio.ensure_future(self.flush())
+
+	def _merge(self, values):
+		if self.key_columns is None:
+			self._buffer.append(values)
+			return
+
+		key = tuple(values[i] for i in self._key_indices)
+		try:
+			totals = self._buffer[key]
+		except KeyError:
+			self._buffer[key] = [values[i] for i in self._value_indices]
+		else:
+			for j, i in enumerate(self._value_indices):
+				totals[j] += values[i]
+
+	def _rows(self, buffer):
+		if self.key_columns is None:
+			return buffer
+
+		return [self._row(key, totals) for key, totals in buffer.items()]
+
+	def _row(self, key, totals):
+		row = [None] * len(self.columns)
+		for i, value in zip(self._key_indices, key):
+			row[i] = value
+		for i, value in zip(self._value_indices, totals):
+			row[i] = value
+		return row
+
+	async def flush(self) -> bool:
+		"""write everything buffered so far. Return whether that succeeded."""
+		async with self._lock:
+			if not self._buffer:
+				return True
+			buffer, self._buffer = self._buffer, type(self._buffer)()
+			rows = self._rows(buffer)
+
+			start = time.perf_counter()
+			try:
+				await self._write(rows)
+			except _ROW_ERRORS as exc:
+				# some of the rows are bad, and retrying them would fail forever
+				retry = []
+				try:
+					written = await self._split_rejected(rows, exc, retry)
+				finally:
+					if retry:
+						self._requeue(self._unrows(retry))
+			except _TRANSIENT_ERRORS:
+				logger.exception('failed to write %d rows to %s, retrying later', len(rows), self.table)
+				self._requeue(buffer)
+				return False
+			except Exception:
+				logger.exception('failed to write %d rows to %s, dropping them', len(rows), self.table)
+				self.dropped += len(rows)
+				return False
+			except BaseException:
+				# cancelled: the batch may not have been written, so keep it for the next flush
+				self._requeue(buffer)
+				raise
+			else:
+				retry = None
+				written = len(rows)
+			self.flush_times.record(time.perf_counter() - start)
+			self.rows_written += written
+			return not retry
+
+	async def _write(self, rows):
+		async with self.pool.acquire() as conn, conn.transaction():
+			if self.key_columns is None:
+				await conn.copy_records_to_table(
+					self.table, records=rows, columns=self.columns, schema_name=self.schema,
+				)
+			else:
+				await conn.executemany(self._upsert_query, rows)
+
+	async def _split_rejected(self, rows, exc, retry) -> int:
+		"""Write the rows of a batch which the database rejected, in halves, and drop the rows it rejects.
+		Rows which couldn't be written because of a transient error are added to retry. Return how many were written.
+		"""
+		if len(rows) == 1:
+			logger.error('dropped a row which %s rejected: %r: %s', self.table, rows[0], exc)
+			self.dropped += 1
+			return 0
+
+		middle = len(rows) // 2
+		try:
+			written = await self._write_bisecting(rows[:middle], retry)
+		except BaseException:
+			# cancelled, so keep the second half for the next flush too
+			retry.extend(rows[middle:])
+			raise
+		return written + await self._write_bisecting(rows[middle:], retry)
+
+	async def _write_bisecting(self, rows, retry) -> int:
+		try:
+			await self._write(rows)
+		except _ROW_ERRORS as exc:
+			return await self._split_rejected(rows, exc, retry)
+		except _TRANSIENT_ERRORS:
+			logger.exception('failed to write %d rows to %s, retrying later', len(rows), self.table)
+			retry.extend(rows)
+			return 0
+		except Exception:
+			logger.exception('failed to write %d rows to %s, dropping them', len(rows), self.table)
+			self.dropped += len(rows)
+			return 0
+		except BaseException:
+			retry.extend(rows)
+			raise
+		return len(rows)
+
+	def _unrows(self, rows):
+		"""the inverse of _rows"""
+		if self.key_columns is None:
+			return rows
+		return {
+			tuple(row[i] for i in self._key_indices): [row[i] for i in self._value_indices]
+			for row in rows
+		}
+
+	def _requeue(self, buffer):
+		if self.key_columns is None:
+			room = max(0, self.max_buffered - len(self._buffer))
+			self.dropped += max(0, len(buffer) - room)
+			# the failed rows are older, so they go first
+			self._buffer[:0] = buffer[:room]
+			return
+
+		for key, totals in buffer.items():
+			if key not in self._buffer and len(self._buffer) >= self.max_buffered:
+				self.dropped += 1
+				continue
+			self._merge(self._row(key, totals))
+
+	async def _flush_periodically(self):
+		while True:
+			await asyncio.sleep(self.interval)
+			await self.flush()
+
+	async def close(self):
+		"""stop the periodic flush and write what's left. Safe to call more than once."""
+		self._closed = True
+		if self._task is not None:
+			# wait for a periodic flush which is in progress rather than cancelling it halfway through
+			async with self._lock:
+				self._task.cancel()
+				self._task = None
+		await self.flush()
+
+class CursorPages(discord.ui.View):
+	"""Shows the rows of a query a page at a time, reading them from a server-side cursor.
+
+	Only the rows of the page being shown are in memory. asyncpg cursors only move forwards, so up to max_history
+	already rendered pages are kept to go back to. The cursor's connection is held in a transaction
+	until the last row has been read or the view times out, at which point the transaction is committed.
+
+	If pool is a single connection, holding a transaction open on it would put every other query the bot runs
+	in that transaction, so the first max_rows rows are read at once instead, and shown from memory.
+	"""
+
+	# leaves room for the status line under the table
+	MAX_TABLE_LENGTH = 1900
+	# wider tables wrap in most Discord clients, which makes them unreadable
+	MAX_WIDTH = 100
+
+	def __init__(self, pool, query, *, author_id, page_size=20, max_history=20, max_rows=1000, timeout=120.0):
+		super().__init__(timeout=timeout)
+		self.pool = pool
+		self.query = query
+		self.author_id = author_id
+		self.page_size = page_size
+		self.max_history = max_history
+		self.max_rows = max_rows
+		self.message = None
+
+		self.connection = None
+		self._transaction = None
+		self._cursor = None
+		# the rows not shown yet, if pool is a single connection
+		self._rows = None
+		# whether there were more than max_rows rows, which weren't read
+		self.truncated = False
+		# the rows read past the end of the current page, used to tell whether there is another one
+		self._lookahead = []
+		self.exhausted = False
+		# the cursor can only run one fetch at a time
+		self._lock = asyncio.Lock()
+
+		# page number: (rendered page, number of rows in it)
+		self._pages = collections.OrderedDict()
+		self.page_number = 0
+		self.last_page = 0
+		self.rows_read = 0
+
+	async def start(self):
+		"""open the cursor and read the first page"""
+		if not isinstance(self.pool, asyncpg.Pool):
+			with span('db'):
+				# a cursor needs a transaction, but this one ends as soon as the rows have been read
+				async with self.pool.transaction():
+					cursor = await self.pool.cursor(self.query)
+					rows = await cursor.fetch(self.max_rows + 1)
+			self.truncated = len(rows) > self.max_rows
+			self._rows = collections.deque(rows[:self.max_rows])
+			await self._read_page()
+			self._update_buttons()
+			return
+
+		self.connection = await self.pool.acquire()
+		try:
+			with span('db'):
+				self._transaction = self.connection.transaction()
+				await self._transaction.start()
+				self._cursor = await self.connection.cursor(self.query)
+			await self._read_page()
+		except BaseException as exc:
+			await self.close(exc)
+			raise
+		self._update_buttons()
+
+	async def close(self, exc=None):
+		"""end the transaction and release the connection. Safe to call more than once."""
+		self.exhausted = True
+		self._cursor = None
+		self._lookahead = []
+		connection, self.connection = self.connection, None
+		if connection is None:
+			return
+		try:
+			if self._transaction is not None and not connection.is_closed():
+				if exc is None:
+					await self._transaction.commit()
+				else:
+					await self._transaction.rollback()
+		finally:
+			self._transaction = None
+			await self.pool.release(connection)
+
+	async def _fetch(self, n):
+		if self._rows is None:
+			return await self._cursor.fetch(n)
+		return [self._rows.popleft() for _ in range(min(n, len(self._rows)))]
+
+	async def _read_page(self):
+		with span('db'):
+			rows = self._lookahead + await self._fetch(self.page_size + 1 - len(self._lookahead))
+		rows, self._lookahead = rows[:self.page_size], rows[self.page_size:]
+		self.rows_read += len(rows)
+
+		# rows which don't fit in one message are split across several pages
+		with span('render'):
+			tables = paginate_table(
+				rows, max_length=self.MAX_TABLE_LENGTH - len(codeblock('')), max_width=self.MAX_WIDTH,
+			) or [('', 0)]
+		self.page_number = self.last_page + 1
+		for table, row_count in tables:
+			self.last_page += 1
+			self._pages[self.last_page] = codeblock(table) if table else '', row_count
+			if len(self._pages) > self.max_history:
+				self._pages.popitem(last=False)
+
+		if not self._lookahead:
+			await self.close()
+
+	@property
+	def single_page(self):
+		return self.exhausted and self.last_page == 1
+
+	def content(self, elapsed: str = None):
+		table, row_count = self._pages[self.page_number]
+		took = f' in {elapsed}' if elapsed is not None else ''
+		if self.single_page:
+			# an empty result has no table
+			return f'{table}\n*{row_count} rows retrieved{took}.*'.lstrip()
+		took = f', retrieved{took}' if took else ''
+
+		last_row = sum(count for number, (_, count) in self._pages.items() if number <= self.page_number)
+		# rows of pages which have been dropped from the history
+		last_row += self.rows_read - sum(count for _, count in self._pages.values())
+		first_row = last_row - row_count + 1
+		total = f'{self.rows_read}' if self.exhausted and not self.truncated else f'{self.rows_read}+'
+		return f'{table}\n*Page {self.page_number}: rows {first_row}–{last_row} of {total}{took}.*'
+
+	def _update_buttons(self):
+		self.previous_page.disabled = self.page_number - 1 not in self._pages
+		self.next_page.disabled = self.exhausted and self.page_number + 1 not in self._pages
+
+	async def interaction_check(self, interaction):
+		return interaction.user.id == self.author_id
+
+	async def _show(self, interaction):
+		self._update_buttons()
+		await interaction.response.edit_message(content=self.content(), view=self)
+
+	@discord.ui.button(label='Previous', style=discord.ButtonStyle.secondary)
+	async def previous_page(self, interaction, button):
+		self.page_number -= 1
+		await self._show(interaction)
+
+	@discord.ui.button(label='Next', style=discord.ButtonStyle.secondary)
+	async def next_page(self, interaction, button):
+		async with self._lock:
+			if self.page_number + 1 in self._pages:
+				self.page_number += 1
+			elif not self.exhausted:
+				await self._read_page()
+			await self._show(interaction)
+
+	async def on_timeout(self):
+		await self.close()
+		if self.message is not None:
+			with contextlib.suppress(discord.HTTPException):
+				await self.message.edit(view=None)
+
+	async def on_error(self, interaction, error, item):
+		await self.close(error)
+		self.stop()
+		if isinstance(error, (asyncpg.PostgresError, asyncpg.InterfaceError)):
+			await interaction.response.send_message(f'{type(error).__name__}: {error}', ephemeral=True)
+			return
+		await super().on_error(interaction, error, item)
+
+def describe_span(timer: span) -> str:
+	"""return how long a span took, followed by how long its children took if it has any, e.g. 12.3ms (db 11.0ms, other 1.3ms)"""
+	ms = lambda seconds: f'{seconds * 1000:.2f}ms'
+	if not timer.children:
+		return ms(timer.elapsed)
+	return f'{ms(timer.elapsed)} ({", ".join(f"{name} {ms(seconds)}" for name, seconds in timer.breakdown().items())})'
+
+def _plan_nodes(node, depth=0):
+	yield node, depth
+	for child in node.get('Plans', ()):
+		yield from _plan_nodes(child, depth + 1)
+
+def _describe_node(node):
+	description = node['Node Type']
+	if 'Relation Name' in node:
+		description += f' on {node["Relation Name"]}'
+	if 'Index Name' in node:
+		description += f' using {node["Index Name"]}'
+	return description
+
+def summarize_plan(explained, *, top=5, misestimate_factor=10, large_scan_rows=10_000) -> str:
+	"""Summarize the output of EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON).
+
+	Lists the top nodes by time spent in the node itself (not in its children), the worst nodes whose row estimate
+	was off by at least misestimate_factor, and the biggest sequential scans which read at least large_scan_rows rows.
+	"""
+	explained = explained[0]
+	root = explained['Plan']
+	nodes = list(_plan_nodes(root))
+
+	lines = [
+		f'Planning {explained.get("Planning Time", 0):.2f}ms, execution {explained.get("Execution Time", 0):.2f}ms, '
+		f'{root.get("Shared Hit Blocks", 0)} blocks hit, {root.get("Shared Read Blocks", 0)} read',
+	]
+
+	# actual times are averages per loop, and include the node's children
+	def total_time(node):
+		return node.get('Actual Total Time', 0) * node.get('Actual Loops', 1)
+	exclusive = [
+		(total_time(node) - sum(map(total_time, node.get('Plans', ()))), node)
+		for node, _ in nodes
+	]
+	exclusive.sort(key=lambda item: item[0], reverse=True)
+	lines.append('Slowest nodes (excluding children):')
+	for time_, node in exclusive[:top]:
+		lines.append(f'  {max(time_, 0):.2f}ms {_describe_node(node)} ({node.get("Actual Loops", 1)} loops)')
+
+	misestimates = []
+	for node, _ in nodes:
+		estimated, actual = node.get('Plan Rows', 0), node.get('Actual Rows', 0)
+		factor = max(estimated, actual) / max(min(estimated, actual), 1)
+		if node.get('Actual Loops', 1) and factor >= misestimate_factor:
+			misestimates.append((factor, f'  {_describe_node(node)}: estimated {estimated} rows, got {actual}'))
+	if misestimates:
+		misestimates.sort(key=lambda item: item[0], reverse=True)
+		lines.append('Row estimate misses:')
+		lines.extend(line for _, line in misestimates[:top])
+
+	scans = []
+	for node, _ in nodes:
+		if node['Node Type'] != 'Seq Scan':
+			continue
+		read = (node.get('Actual Rows', 0) + node.get('Rows Removed by Filter', 0)) * node.get('Actual Loops', 1)
+		if read >= large_scan_rows:
+			kept = node.get('Actual Rows', 0) * node.get('Actual Loops', 1)
+			scans.append((read, f'  {_describe_node(node)}: read {read} rows, kept {kept}'))
+	if scans:
+		scans.sort(key=lambda item: item[0], reverse=True)
+		lines.append('Large sequential scans:')
+		lines.extend(line for _, line in scans[:top])
+
+	return '\n'.join(lines)
+
 class BotBinSql(commands.Cog):
-	def __init__(self, pool):
+	def __init__(self, pool, queries=None):
 		self.pool = pool
+		self.queries = queries
 
 	async def cog_command_error(self, context, error):
 		error = getattr(error, 'original', error)
@@ -67,35 +1180,222 @@ class BotBinSql(commands.Cog):
 	@sql_command.command(name='execute', aliases=['e'])
 	async def sql_execute_command(self, context, *, query):
 		"""Execute a SQL query."""
-		with timeit() as timer:
+		with span('db') as timer:
 			result = await self.pool.execute(query.strip('`'))
-		elapsed = round(timer.elapsed * 1000, 2)
 
-		await context.send(f'`{result}`\n*Executed in {elapsed}ms.*')
+		await context.send(f'`{result}`\n*Executed in {describe_span(timer)}.*')
 
 	@sql_command.command(name='fetch', aliases=['f'])
 	async def sql_fetch_command(self, context, *, query):
-		"""Get the rows of a SQL query."""
-		with timeit() as timer:
-			results = await self.pool.fetch(query.strip('`'))
-		elapsed = round(timer.elapsed * 1000, 2)
+		"""Get the rows of a SQL query, a page at a time."""
+		pages = CursorPages(self.pool, query.strip('`'), author_id=context.author.id)
+		with span('sql fetch') as timer:
+			await pages.start()
+		elapsed = describe_span(timer)
 
-		message = codeblock(str(PrettyTable(results)))
-		await context.send(f'{message}\n*{len(results)} rows retrieved in {elapsed}ms.*')
+		if pages.single_page:
+			await context.send(pages.content(elapsed))
+			return
+		pages.message = await context.send(pages.content(elapsed), view=pages)
 
 	@sql_command.command(name='fetchval', aliases=['fv'])
 	async def sql_fetchval_command(self, context, *, query):
 		"""Get a single value from a SQL query."""
-		with timeit() as timer:
-			result = await self.pool.fetchval(query.strip('`'))
-		elapsed = round(timer.elapsed * 1000, 2)
+		with span('sql fetchval') as timer:
+			with span('db'):
+				result = await self.pool.fetchval(query.strip('`'))
+			# fetchval returns a native python result
+			# so its repr is probably python code
+			with span('render'):
+				message = codeblock(repr(result), lang='python')
+
+		await context.send(f'{message}\n*Retrieved in {describe_span(timer)}.*')
+
+	@sql_command.command(name='bench')
+	async def sql_bench_command(
+		self,
+		context,
+		runs: Optional[int] = None,
+		concurrency: Optional[int] = None,
+		commit: Optional[Literal['commit']] = None,
+		*,
+		query,
+	):
+		"""Run a SQL query many times at once and show how long it took.
+
+		Usage: sql bench [runs=100] [concurrency=10] [commit] <query>
+		Each run is rolled back, unless "commit" is given.
+		Query times include beginning and ending each run's transaction.
+		"""
+		runs = max(1, min(runs or 100, 10_000))
+		concurrency = max(1, min(concurrency or 10, 100, runs))
+		query = query.strip('`')
+		is_pool = isinstance(self.pool, asyncpg.Pool)
+		if not is_pool:
+			# a single connection can only run one query at a time
+			concurrency = 1
+
+		latency, wait, server = Histogram(), Histogram(), Histogram()
+		errors = []
+		remaining = runs
+
+		async def run_one():
+			start = time.perf_counter()
+			conn = await self.pool.acquire() if is_pool else self.pool
+			acquired = time.perf_counter()
+			try:
+				transaction = conn.transaction()
+				await transaction.start()
+				try:
+					await conn.fetch(query)
+				except BaseException:
+					await transaction.rollback()
+					raise
+				if commit:
+					await transaction.commit()
+				else:
+					await transaction.rollback()
+			finally:
+				end = time.perf_counter()
+				if is_pool:
+					await self.pool.release(conn)
+			wait.record(acquired - start)
+			server.record(end - acquired)
+			latency.record(end - start)
+
+		async def worker():
+			nonlocal remaining
+			while remaining > 0:
+				remaining -= 1
+				try:
+					await run_one()
+				# including timeouts and connection errors from acquire,
+				# so that one failure doesn't end the command while the other workers keep running queries
+				except Exception as exc:
+					errors.append(exc)
+
+		with span('sql bench') as timer:
+			await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+		ms = lambda seconds: f'{seconds * 1000:.2f}ms'
+		percentiles = lambda histogram: ', '.join(
+			[f'p{percent} {ms(histogram.percentile(percent))}' for percent in (50, 90, 99)]
+			+ [f'max {ms(histogram.max)}']
+		)
+		completed = latency.count
+		lines = [
+			f'{completed}/{runs} runs at concurrency {concurrency} in {timer.elapsed:.2f}s: '
+			f'{completed / timer.elapsed:.1f} runs/s ({"committed" if commit else "rolled back"})',
+			f'Latency:   {percentiles(latency)}',
+			f'Pool wait: {percentiles(wait)}',
+			f'Query:     {percentiles(server)}',
+		]
+		if errors:
+			first = type(errors[0]).__name__ + (f': {errors[0]}' if str(errors[0]) else '')
+			lines.append(f'{len(errors)} errors, the first: {first}')
+		await context.send(codeblock('\n'.join(lines)))
+
+	@sql_command.command(name='explain')
+	async def sql_explain_command(self, context, *, query):
+		"""Run a SQL query under EXPLAIN ANALYZE, in a transaction which is rolled back, and summarize its plan."""
+		query = query.strip('`')
+		conn = await self.pool.acquire() if isinstance(self.pool, asyncpg.Pool) else self.pool
+		try:
+			transaction = conn.transaction()
+			await transaction.start()
+			try:
+				explained = await conn.fetchval('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query)
+			finally:
+				await transaction.rollback()
+		finally:
+			if conn is not self.pool:
+				await self.pool.release(conn)
+
+		# without a json codec, asyncpg returns the text
+		if isinstance(explained, str):
+			explained = json.loads(explained)
+		plan = io.BytesIO(json.dumps(explained, indent=2).encode())
+		await context.send(codeblock(summarize_plan(explained)), file=discord.File(plan, 'plan.json'))
+
+	@sql_command.command(name='pool')
+	async def sql_pool_command(self, context):
+		"""Show connection pool usage, and how long connections are waited for and held."""
+		ms = lambda seconds: f'{seconds * 1000:.1f}ms'
+		lines = []
+		if isinstance(self.pool, asyncpg.Pool):
+			size, idle = self.pool.get_size(), self.pool.get_idle_size()
+			lines.append(f'Connections: {size - idle} in use, {idle} idle, {self.pool.get_max_size()} max')
+
+		stats = pool_stats(self.pool)
+		for name, histogram in ('Acquire wait', stats.acquire_wait), ('Hold time', stats.hold):
+			lines.append(
+				f'{name}: p50 {ms(histogram.percentile(50))}, p99 {ms(histogram.percentile(99))}, '
+				f'max {ms(histogram.max)} over {histogram.count} acquisitions'
+			)
+		lines.append(f'Connections released after being held for over {stats.leak_threshold}s: {stats.leaks}')
+		lines.extend(f'• {call_site}: still held after {held:.1f}s' for call_site, held in stats.held_too_long())
+
+		await context.send(codeblock('\n'.join(lines)))
+
+	@sql_command.command(name='stats')
+	async def sql_stats_command(self, context, count: int = 10):
+		"""Show the statements which took the most time in total."""
+		ms = lambda seconds: f'{seconds * 1000:.1f}ms'
+		wait = pool_stats(self.pool).acquire_wait
+		lines = [
+			f'{query_stats.slow} queries over {ms(query_stats.slow_threshold)}. '
+			f'Pool wait: p50 {ms(wait.percentile(50))}, p99 {ms(wait.percentile(99))}, total {ms(wait.total)}',
+		]
+		length = len(lines[0])
+		for stats in query_stats.top(count):
+			query = stats.query if len(stats.query) <= 200 else stats.query[:199] + '…'
+			line = (
+				f'{ms(stats.total)} total, {stats.calls} calls, {ms(stats.mean)} mean, {ms(stats.max)} max, '
+				f'{stats.rows} rows: {query}'
+			)
+			length += len(line) + 1
+			if length > 1900:
+				break
+			lines.append(line)
+		if not query_stats.top(1):
+			lines.append("No queries recorded. Is config['query_stats'] set?")
+		await context.send(codeblock('\n'.join(lines)))
+
+	@sql_command.command(name='queries')
+	async def sql_queries_command(self, context):
+		"""Show how long each named query takes."""
+		if not self.queries:
+			await context.send('No named queries are loaded.')
+			return
+
+		ms = lambda seconds: f'{seconds * 1000:.1f}ms'
+		queries = sorted(self.queries, key=lambda query: query.timings.total, reverse=True)
+		await context.send(codeblock('\n'.join(
+			f'{query.name}: {query.timings.count} calls, p50 {ms(query.timings.percentile(50))}, '
+			f'p99 {ms(query.timings.percentile(99))}, total {ms(query.timings.total)}'
+			for query in queries
+		)))
+
+	@sql_command.command(name='cache')
+	async def sql_cache_command(self, context):
+		"""Show the hit rates of cached queries."""
+		caches = sorted(_caches, key=lambda cache: cache.hits + cache.misses, reverse=True)
+		if not caches:
+			await context.send('No cached queries.')
+			return
 
-		# fetchval returns a native python result
-		# so its repr is probably python code
-		message = codeblock(repr(result), lang='python')
-		await context.send(f'{message}\n*Retrieved in {elapsed}ms.*')
+		lines = []
+		for cache in caches:
+			stats = cache.stats()
+			lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+			hit_rate = stats['hits'] / lookups if lookups else 0
+			lines.append(
+				f'{cache.name}: {stats["hits"]}/{lookups} hits ({hit_rate:.0%}), {stats["misses"]} misses, '
+				f'{stats["coalesced"]} coalesced, {stats["size"]}/{cache.maxsize} cached'
+			)
+		await context.send(codeblock('\n'.join(lines)))
 
 async def setup(bot):
 	if bot.case_insensitive:
 		BotBinSql.sql_command.aliases.clear()
-	await bot.add_cog(BotBinSql(bot.pool))
+	await bot.add_cog(BotBinSql(bot.pool, getattr(bot, 'queries', None)))
@@ -27,7 +27,8 @@ setup(
 	extras_require={
 		'sql': [
 			'aiocontextvars>=0.2.2',
-			'asyncpg',
+			# StatsConnection uses Connection.get_reset_query, which is new in 0.30
+			'asyncpg>=0.30',
 			'prettytable',
 		],
 		'uvloop': [